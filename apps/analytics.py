@@ -0,0 +1,156 @@
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Value, IntegerField
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.timezone import make_aware
+from redis.exceptions import RedisError
+
+from apps.models import RentalInfo, RentByBot, RentalOrder, DailyRentalStat, Booking, Location
+from root.settings import redis
+
+ROLLUP_LOOKBACK_DAYS = 7
+TOUCHED_DAYS_KEY = 'analytics:touched-days'
+
+
+def _rollup_rows(queryset, channel, paid):
+    rows = (
+        queryset.order_by()
+        .values('pickup_date', 'car_id', 'car__category_id', 'pickup_location_id')
+        .annotate(rentals=Count('id'), **paid)
+    )
+    return [
+        DailyRentalStat(
+            day=row['pickup_date'], channel=channel, car_id=row['car_id'], category_id=row['car__category_id'],
+            pickup_location_id=row['pickup_location_id'], rentals=row['rentals'],
+            paid_rentals=row['paid_rentals'], revenue=row['revenue'] or 0,
+        )
+        for row in rows
+    ]
+
+
+def rollup_days(days):
+    days = sorted(set(days))
+    if not days:
+        return 0
+    stats = _rollup_rows(
+        RentalInfo.objects.filter(pickup_date__in=days), Booking.Channel.WEB,
+        {'paid_rentals': Value(0, output_field=IntegerField()), 'revenue': Value(0, output_field=IntegerField())},
+    )
+    stats += _rollup_rows(
+        RentByBot.objects.filter(pickup_date__in=days), Booking.Channel.BOT,
+        {
+            'paid_rentals': Count('id', filter=Q(payment_status='paid')),
+            'revenue': Sum('paid_amount', filter=Q(payment_status='paid')),
+        },
+    )
+    with transaction.atomic():
+        DailyRentalStat.objects.filter(day__in=days).delete()
+        DailyRentalStat.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
+
+
+def touched_days(since):
+    """Pickup days of bookings created or changed since `since`."""
+    web = RentalOrder.objects.filter(created_at__gte=since).values_list('rental__pickup_date', flat=True)
+    bot = RentByBot.objects.filter(Q(created_at__gte=since) | Q(updated_at__gte=since)).values_list(
+        'pickup_date', flat=True
+    )
+    return set(web.distinct()) | set(bot.distinct())
+
+
+def _mark_touched_days(days):
+    try:
+        redis.sadd(TOUCHED_DAYS_KEY, *{str(day) for day in days})
+    except RedisError:
+        pass
+
+
+def mark_touched_days(*days):
+    """
+    Remember pickup days whose bookings were edited or deleted; those leave no trace for touched_days,
+    RentalInfo has no updated_at and deleted rows are gone.
+    """
+    days = [day for day in days if day]
+    if days:
+        transaction.on_commit(lambda: _mark_touched_days(days))
+
+
+def pop_touched_days():
+    try:
+        with redis.pipeline() as pipe:
+            pipe.smembers(TOUCHED_DAYS_KEY)
+            pipe.delete(TOUCHED_DAYS_KEY)
+            days, _ = pipe.execute()
+    except RedisError:
+        return set()
+    return {date.fromisoformat(day) for day in days}
+
+
+def recent_days(lookback=ROLLUP_LOOKBACK_DAYS):
+    today = timezone.localdate()
+    return {today - timedelta(days=offset) for offset in range(lookback)}
+
+
+GROUPINGS = {
+    'day': ('day',),
+    'channel': ('channel',),
+    'car': ('car_id', 'car__name'),
+    'category': ('category_id', 'category__name'),
+    'location': ('pickup_location_id', 'pickup_location__name'),
+}
+
+
+def rental_report(date_from, date_to, group_by):
+    stats = DailyRentalStat.objects.filter(day__range=(date_from, date_to))
+    metrics = {
+        'rentals': Sum('rentals'),
+        'paid_rentals': Sum('paid_rentals'),
+        'revenue': Sum('revenue'),
+    }
+    fields = GROUPINGS[group_by]
+    results = list(stats.values(*fields).annotate(**metrics).order_by(fields[0]))
+    totals = {key: sum(row[key] or 0 for row in results) for key in metrics}
+    return results, totals
+
+
+DEMAND_BUCKETS = ('day', 'week', 'month')
+
+
+def demand_matrix(date_from, date_to, bucket):
+    """Origin→destination booking counts per time bucket, rows are pickup and columns dropoff locations."""
+    start = make_aware(datetime.combine(date_from, datetime.min.time()))
+    end = make_aware(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    flows = (
+        Booking.objects
+        .filter(pickup_at__gte=start, pickup_at__lt=end)
+        .annotate(bucket=Trunc('pickup_at', bucket))
+        .values_list('bucket', 'pickup_location_id', 'dropoff_location_id')
+        .annotate(total=Count('id'))
+        .order_by('bucket')
+    )
+    locations = list(Location.objects.order_by('id').values_list('id', 'name'))
+    index = {location_id: i for i, (location_id, _) in enumerate(locations)}
+    size = len(locations)
+
+    matrices = {}
+    for bucket_start, origin, destination, total in flows:
+        matrix = matrices.setdefault(bucket_start, [[0] * size for _ in range(size)])
+        matrix[index[origin]][index[destination]] = total
+
+    buckets = []
+    for bucket_start, matrix in matrices.items():
+        outflow = [sum(row) for row in matrix]
+        inflow = [sum(column) for column in zip(*matrix)]
+        buckets.append({
+            'bucket': timezone.localtime(bucket_start).date(),
+            'matrix': matrix,
+            'outflow': outflow,
+            'inflow': inflow,
+            'net': [incoming - outgoing for incoming, outgoing in zip(inflow, outflow)],
+        })
+    return {
+        'locations': [{'id': location_id, 'name': name} for location_id, name in locations],
+        'buckets': buckets,
+    }
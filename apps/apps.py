@@ -1,4 +1,12 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import pre_migrate
+
+
+def create_postgres_extensions(using, **kwargs):
+    # btree_gist lets GiST indexes and exclusion constraints combine `car_id =` with range operators.
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
 
 
 class AppsConfig(AppConfig):
@@ -7,3 +15,4 @@ class AppsConfig(AppConfig):
 
     def ready(self):
         import apps.signals
+        pre_migrate.connect(create_postgres_extensions, sender=self)
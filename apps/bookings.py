@@ -0,0 +1,244 @@
+import calendar
+import logging
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.contrib.postgres.fields import DateTimeRangeField
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DateTimeField, Exists, F, Func, OuterRef, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.utils.timezone import make_aware, localtime
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.status import HTTP_409_CONFLICT
+
+from apps.models import Car, RentalInfo, RentByBot, CarRentalStat, Booking
+
+logger = logging.getLogger(__name__)
+
+BOOKING_MODELS = (RentalInfo, RentByBot)
+BOOKING_CHANNELS = {
+    RentalInfo: Booking.Channel.WEB,
+    RentByBot: Booking.Channel.BOT,
+}
+# A card booking that is still unpaid after this long is treated as abandoned.
+UNPAID_BOOKING_TIMEOUT = timedelta(minutes=30)
+BOOKING_SYNC_FIELDS = (
+    'car', 'pickup_location', 'dropoff_location', 'pickup_at', 'dropoff_at', 'period', 'payment_status', 'tg_user_id'
+)
+
+
+class BookingConflict(APIException):
+    status_code = HTTP_409_CONFLICT
+    default_detail = 'The car is already booked for this period.'
+    default_code = 'booking_conflict'
+
+
+def _combine(instance, date_field, time_field):
+    opts = instance._meta
+    date = opts.get_field(date_field).to_python(getattr(instance, date_field))
+    time = opts.get_field(time_field).to_python(getattr(instance, time_field))
+    return make_aware(datetime.combine(date, time))
+
+
+def booking_period(instance):
+    return DateTimeTZRange(
+        _combine(instance, 'pickup_date', 'pickup_time'),
+        _combine(instance, 'dropoff_date', 'dropoff_time'),
+        '[)'
+    )
+
+
+def _timestamp_expression(date_field, time_field):
+    local = Func(F(date_field), F(time_field), arg_joiner=' + ', template='(%(expressions)s)',
+                 output_field=DateTimeField())
+    return Func(local, Value(settings.TIME_ZONE), arg_joiner=' AT TIME ZONE ', template='(%(expressions)s)',
+                output_field=DateTimeField())
+
+
+def booking_period_expression():
+    return Func(
+        _timestamp_expression('pickup_date', 'pickup_time'),
+        _timestamp_expression('dropoff_date', 'dropoff_time'),
+        Value('[)'),
+        function='tstzrange',
+        output_field=DateTimeRangeField()
+    )
+
+
+def holding_bookings(model):
+    """Rows of a booking model that take part in its exclusion constraint."""
+    if model is RentByBot:
+        return model.objects.exclude(payment_status='failed')
+    return model.objects.all()
+
+
+def invalid_periods(model):
+    """Rows without a period whose drop off is not after their pick up, so no range can be built for them."""
+    return model.objects.filter(period__isnull=True).exclude(GreaterThan(
+        _timestamp_expression('dropoff_date', 'dropoff_time'), _timestamp_expression('pickup_date', 'pickup_time')
+    ))
+
+
+def overlapping_periods(model):
+    """
+    Rows without a period whose computed range overlaps a booking of the same car that already has one,
+    or an earlier row; filling their period would violate the exclusion constraint.
+    """
+    computed = Case(
+        When(
+            GreaterThan(
+                _timestamp_expression('dropoff_date', 'dropoff_time'),
+                _timestamp_expression('pickup_date', 'pickup_time'),
+            ),
+            then=booking_period_expression(),
+        ),
+        output_field=DateTimeRangeField(),
+    )
+    bookings = holding_bookings(model).annotate(backfill_period=Coalesce(F('period'), computed))
+    earlier = bookings.filter(
+        Q(period__isnull=False) | Q(pk__lt=OuterRef('pk')),
+        car=OuterRef('car_id'), backfill_period__overlap=OuterRef('backfill_period'),
+    )
+    return bookings.filter(period__isnull=True, backfill_period__isnull=False).filter(Exists(earlier))
+
+
+def cross_channel_conflicts(model):
+    """Rows whose period overlaps an active booking of the other channel in the unified Booking table."""
+    others = active_bookings().filter(car=OuterRef('car_id'), period__overlap=OuterRef('period')).exclude(
+        channel=BOOKING_CHANNELS[model], source_id=OuterRef('pk')
+    )
+    return holding_bookings(model).filter(period__isnull=False).filter(Exists(others))
+
+
+def to_booking(instance):
+    period = instance.period or booking_period(instance)
+    return Booking(
+        channel=BOOKING_CHANNELS[type(instance)],
+        source_id=instance.pk,
+        car_id=instance.car_id,
+        pickup_location_id=instance.pickup_location_id,
+        dropoff_location_id=instance.dropoff_location_id,
+        pickup_at=period.lower,
+        dropoff_at=period.upper,
+        period=period,
+        payment_status=getattr(instance, 'payment_status', 'pending'),
+        tg_user_id=getattr(instance, 'tg_user_id', None),
+    )
+
+
+def sync_bookings(instances, batch_size=None):
+    Booking.objects.bulk_create(
+        [to_booking(instance) for instance in instances],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['channel', 'source_id'],
+        update_fields=BOOKING_SYNC_FIELDS,
+    )
+
+
+def active_bookings():
+    """Bookings that hold their car, failed card payments release it."""
+    return Booking.objects.exclude(payment_status='failed')
+
+
+def is_car_booked(car_id, period):
+    return active_bookings().filter(car_id=car_id, period__overlap=period).exists()
+
+
+def create_booking(model, **fields):
+    """
+    Insert a booking unless the car is taken in either channel. The car row lock serializes
+    bookings of one car; the exclusion constraint on the unified Booking table is the last line of defence.
+    """
+    booking = model(**fields)
+    period = booking_period(booking)
+    if period.lower >= period.upper:
+        raise ValidationError('Drop off must be after pick up.')
+
+    with transaction.atomic():
+        list(Car.objects.select_for_update().filter(pk=booking.car_id).values_list('pk', flat=True))
+        if is_car_booked(booking.car_id, period):
+            raise BookingConflict
+        try:
+            with transaction.atomic():
+                booking.save()
+        except IntegrityError:
+            raise BookingConflict
+    return booking
+
+
+def record_card_payment(rent_id, charge_id, amount, currency):
+    """
+    Mark a bot booking paid. The locked row cannot be expired meanwhile; a booking that already expired and lost
+    its slot to another one stays failed and is flagged for a refund.
+    """
+    with transaction.atomic():
+        rent = (
+            RentByBot.objects.select_for_update(of=('self',))
+            .select_related('car', 'pickup_location', 'dropoff_location')
+            .filter(pk=rent_id).first()
+        )
+        if rent is None:
+            return None
+        if rent.payment_status == 'failed':
+            # Taking the slot back is a new booking of the car, serialized like create_booking.
+            list(Car.objects.select_for_update().filter(pk=rent.car_id).values_list('pk', flat=True))
+
+        fields = ['payment_status', 'paid_amount', 'paid_currency', 'refund_due', 'updated_at']
+        rent.paid_amount = amount
+        rent.paid_currency = currency
+        rent.payment_status = 'paid'
+        try:
+            with transaction.atomic():
+                rent.save(update_fields=fields)
+        except IntegrityError:
+            rent.payment_status = 'failed'
+            rent.refund_due = True
+            rent.save(update_fields=fields)
+            logger.warning('Rent %s was paid (charge %s) after its slot was rebooked, refund due', rent_id, charge_id)
+    return rent
+
+
+def car_booking_version_name(car_id):
+    return f'booking-car:{car_id}'
+
+
+def occupancy_bitmaps(car_ids, year, month):
+    """Return {car_id: '0110...'} with one character per day of the month, '1' meaning booked."""
+    days = calendar.monthrange(year, month)[1]
+    first_day = date(year, month, 1)
+    month_range = DateTimeTZRange(
+        make_aware(datetime.combine(first_day, datetime.min.time())),
+        make_aware(datetime.combine(first_day + timedelta(days=days), datetime.min.time())),
+        '[)'
+    )
+    bookings = active_bookings().filter(car_id__in=car_ids, period__overlap=month_range).values_list('car_id', 'period')
+    bitmaps = {car_id: [0] * days for car_id in car_ids}
+    for car_id, period in bookings:
+        start = max(localtime(period.lower).date(), first_day)
+        end = min((localtime(period.upper) - timedelta(microseconds=1)).date(), date(year, month, days))
+        for day in range(start.day, end.day + 1):
+            bitmaps[car_id][day - 1] = 1
+    return {car_id: ''.join(map(str, bits)) for car_id, bits in bitmaps.items()}
+
+
+def booking_day(instance):
+    return instance._meta.get_field('pickup_date').to_python(instance.pickup_date)
+
+
+def change_rental_count(car_id, day, delta):
+    cars = Car.objects.filter(pk=car_id)
+    stats = CarRentalStat.objects.filter(car_id=car_id, day=day)
+    if delta < 0:
+        cars = cars.filter(rental_count__gte=-delta)
+        stats = stats.filter(rental_count__gte=-delta)
+    cars.update(rental_count=F('rental_count') + delta)
+    if stats.update(rental_count=F('rental_count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            CarRentalStat.objects.create(car_id=car_id, day=day, rental_count=delta)
+    except IntegrityError:
+        stats.update(rental_count=F('rental_count') + delta)
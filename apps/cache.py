@@ -0,0 +1,155 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from root.settings import redis
+
+VERSION_PREFIX = 'cache-version:'
+
+
+def get_versions(*names):
+    try:
+        versions = redis.mget([VERSION_PREFIX + name for name in names])
+    except RedisError:
+        return None
+    return [version or '0' for version in versions]
+
+
+def _bump_versions(names):
+    try:
+        with redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.incr(VERSION_PREFIX + name)
+            pipe.execute()
+    except RedisError:
+        pass
+
+
+def bump_versions(*names):
+    # Bumping before commit would let a concurrent reader cache old rows under the new version.
+    transaction.on_commit(lambda: _bump_versions(names))
+
+
+def cache_get(key):
+    try:
+        return redis.get(key)
+    except RedisError:
+        return None
+
+
+def cache_set(key, value, timeout):
+    try:
+        redis.set(key, value, ex=timeout)
+    except RedisError:
+        pass
+
+
+def versioned_cache(prefix, version_names, key_parts, build, timeout):
+    """
+    Return the JSON data made by `build`, cached under the current versions of `version_names` and `key_parts`.
+    Without Redis the data is built on every call.
+    """
+    versions = get_versions(*version_names)
+    if versions is None:
+        return build()
+    digest = hashlib.sha1(json.dumps([versions, key_parts], cls=DjangoJSONEncoder).encode()).hexdigest()
+    key = f'{prefix}:{digest}'
+    cached = cache_get(key)
+    if cached is not None:
+        return json.loads(cached)
+    data = build()
+    cache_set(key, json.dumps(data, cls=DjangoJSONEncoder), timeout)
+    return data
+
+
+def model_version_name(model):
+    return model._meta.label_lower
+
+
+class CachedResponseMixin:
+    """
+    Serves GET responses from Redis. Keys embed the version of every model in `cache_models`,
+    so a write to any of them makes the old entries unreachable.
+    """
+    cache_models = ()
+    cache_timeout = 60 * 60
+
+    def get_cache_models(self, request):
+        return self.cache_models
+
+    def get_cache_key(self, request, versions):
+        url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        return f'response:{type(self).__name__}:{":".join(versions)}:{url}'
+
+    def get(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+        versions = get_versions(*map(model_version_name, self.get_cache_models(request)))
+        if versions is None:
+            return super().get(request, *args, **kwargs)
+
+        key = self.get_cache_key(request, versions)
+        cached = cache_get(key)
+        if cached is not None:
+            return HttpResponse(cached, content_type='application/json')
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache_set(key, JSONRenderer().render(response.data), self.cache_timeout)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET with 304 Not Modified when the validators returned by `get_validators`
+    match the request, before any serialization happens. Combined with CachedResponseMixin
+    the validators are cached under the same model versions as the response.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        """Return (version, last_modified), or None when the response cannot be validated cheaply."""
+        return None
+
+    def get_cached_validators(self, request, *args, **kwargs):
+        """(version, last_modified timestamp) from Redis, computing and storing them on a miss."""
+        versions = None
+        if hasattr(self, 'get_cache_models'):
+            versions = get_versions(*map(model_version_name, self.get_cache_models(request)))
+        if versions is not None:
+            key = f'validators:{self.get_cache_key(request, versions)}'
+            cached = cache_get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return None
+        version, last_modified = validators
+        validators = [version, int(last_modified.timestamp()) if last_modified else None]
+        if versions is not None:
+            cache_set(key, json.dumps(validators), self.cache_timeout)
+        return validators
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_cached_validators(request, *args, **kwargs)
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        version, timestamp = validators
+        payload = f'{request.get_full_path()}:{request.accepted_renderer.format}:{version}'
+        etag = quote_etag(hashlib.sha1(payload.encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            if timestamp:
+                response.headers['Last-Modified'] = http_date(timestamp)
+        return response
@@ -0,0 +1,13 @@
+from django.db.models import F
+from django.db.models.functions import Now
+
+from apps.cache import bump_versions, model_version_name
+from apps.models import Category
+
+
+def change_car_amount(category_id, delta):
+    categories = Category.objects.filter(pk=category_id)
+    if delta < 0:
+        categories = categories.filter(car_amount__gte=-delta)
+    if categories.update(car_amount=F('car_amount') + delta, updated_at=Now()):
+        bump_versions(model_version_name(Category))
@@ -0,0 +1,121 @@
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'li', 'ol', 'p', 's',
+    'strong', 'sub', 'sup', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+}
+ALLOWED_URL_SCHEMES = {'http', 'https', 'mailto', ''}
+# HTML elements that never get a closing tag.
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr',
+}
+# Elements dropped together with their content; void ones such as embed are simply dropped.
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+BLOCK_TAGS = {'blockquote', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'ol', 'p', 'table', 'tr', 'ul'}
+
+# Telegram counts caption length after entity parsing. The car caption spends up to ~520 characters on
+# name, category, gasoline and labels, the rest of the 1024 characters is left for the description.
+CAPTION_LIMIT = 1024
+DESCRIPTION_CAPTION_LENGTH = 500
+
+
+class DescriptionParser(HTMLParser):
+    """Collects an allowlisted copy of CKEditor HTML and its plain-text rendering in one pass."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.dropped = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropped += 1
+            return
+        if self.dropped:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag == 'li':
+            self.text.append('• ')
+        if tag not in ALLOWED_TAGS:
+            return
+
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = ''
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name == 'href' and urlsplit(value.strip()).scheme.lower() not in ALLOWED_URL_SCHEMES:
+                continue
+            rendered += f' {name}="{escape(value)}"'
+        self.html.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropped = max(self.dropped - 1, 0)
+            return
+        if self.dropped:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag not in self.open_tags:
+            return
+        # Close everything left open inside this tag so the output stays well formed.
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropped:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.html.append(f'</{self.open_tags.pop()}>')
+
+
+def render_description(html):
+    parser = DescriptionParser()
+    parser.feed(html or '')
+    parser.close()
+    text = ''.join(parser.text)
+    text = re.sub(r'[ \t\r\f\v\xa0]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    text = re.sub(r'\n{2,}', '\n', text).strip()
+    return ''.join(parser.html).strip(), text
+
+
+def truncate(text, length):
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip() + '…'
+
+
+def description_caption(text, length=DESCRIPTION_CAPTION_LENGTH):
+    """Plain text shortened to `length` visible characters and escaped for Telegram's HTML parse mode."""
+    return escape(truncate(text, length), quote=False)
@@ -0,0 +1,100 @@
+import csv
+import json
+from datetime import datetime, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import make_aware
+
+from apps.models import RentalOrder, RentByBot, Review
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'rental-orders': (
+        RentalOrder.objects.order_by('id'),
+        {
+            'id': 'id',
+            'created_at': 'created_at',
+            'user_email': 'user__email',
+            'full_name': 'billing__full_name',
+            'phone': 'billing__phone',
+            'district': 'billing__district__name',
+            'car_id': 'rental__car_id',
+            'car_name': 'rental__car__name',
+            'pickup_location': 'rental__pickup_location__name',
+            'pickup_date': 'rental__pickup_date',
+            'pickup_time': 'rental__pickup_time',
+            'dropoff_location': 'rental__dropoff_location__name',
+            'dropoff_date': 'rental__dropoff_date',
+            'dropoff_time': 'rental__dropoff_time',
+        },
+    ),
+    'bot-bookings': (
+        RentByBot.objects.order_by('id'),
+        {
+            'id': 'id',
+            'created_at': 'created_at',
+            'name': 'name',
+            'phone': 'phone',
+            'tg_user_id': 'tg_user_id',
+            'car_id': 'car_id',
+            'car_name': 'car__name',
+            'pickup_location': 'pickup_location__name',
+            'pickup_date': 'pickup_date',
+            'pickup_time': 'pickup_time',
+            'dropoff_location': 'dropoff_location__name',
+            'dropoff_date': 'dropoff_date',
+            'dropoff_time': 'dropoff_time',
+            'payment_method': 'payment_method',
+            'payment_status': 'payment_status',
+            'paid_amount': 'paid_amount',
+            'paid_currency': 'paid_currency',
+        },
+    ),
+    'reviews': (
+        Review.objects.order_by('id'),
+        {
+            'id': 'id',
+            'created_at': 'created_at',
+            'car_id': 'car_id',
+            'car_name': 'car__name',
+            'user_email': 'user__email',
+            'stars': 'stars',
+            'text': 'text',
+            'is_edited': 'is_edited',
+        },
+    ),
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_rows(name, date_from=None, date_to=None):
+    queryset, columns = EXPORTS[name]
+    if date_from:
+        queryset = queryset.filter(created_at__gte=make_aware(datetime.combine(date_from, datetime.min.time())))
+    if date_to:
+        next_day = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        queryset = queryset.filter(created_at__lt=make_aware(next_day))
+    return list(columns), queryset.values_list(*columns.values()).iterator(chunk_size=CHUNK_SIZE)
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,54 @@
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection
+from django.db.models import F, Func, IntegerField, Value
+
+FACETS = ('category_id', 'capacity', 'steering', 'price_band')
+PRICE_BANDS = (0, 100_000, 300_000, 500_000, 1_000_000)
+
+
+def price_band_expression(bands=PRICE_BANDS):
+    return Func(
+        F('price'), Value(list(bands), output_field=ArrayField(IntegerField())),
+        function='width_bucket', output_field=IntegerField()
+    )
+
+
+def car_facet_counts(queryset, bands=PRICE_BANDS):
+    inner = queryset.order_by().annotate(price_band=price_band_expression(bands)).values(*FACETS)
+    inner_sql, params = inner.query.sql_with_params()
+
+    columns = ', '.join(FACETS)
+    groupings = ', '.join(f'GROUPING({facet})' for facet in FACETS)
+    grouping_sets = ', '.join(f'({facet})' for facet in FACETS)
+    sql = (
+        f'SELECT {columns}, {groupings}, COUNT(*) FROM ({inner_sql}) AS cars '
+        f'GROUP BY GROUPING SETS ({grouping_sets}, ())'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    size = len(FACETS)
+    result = {facet: [] for facet in FACETS}
+    result['total'] = 0
+    for row in rows:
+        values, grouped, count = row[:size], row[size:2 * size], row[-1]
+        if all(grouped):
+            result['total'] = count
+            continue
+        index = grouped.index(0)
+        result[FACETS[index]].append({'value': values[index], 'count': count})
+
+    result['category'] = sorted(result.pop('category_id'), key=lambda x: x['value'])
+    for facet in ('capacity', 'steering'):
+        result[facet].sort(key=lambda x: x['value'])
+    result['price_band'] = [
+        {
+            'min': bands[item['value'] - 1],
+            'max': bands[item['value']] if item['value'] < len(bands) else None,
+            'count': item['count'],
+        }
+        for item in sorted(result['price_band'], key=lambda x: x['value'])
+        if item['value'] > 0
+    ]
+    return result
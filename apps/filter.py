@@ -1,5 +1,9 @@
-from django_filters import FilterSet, NumberFilter, CharFilter
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.db.models import Exists, OuterRef
+from django_filters import FilterSet, NumberFilter, CharFilter, IsoDateTimeFromToRangeFilter
+from rest_framework.exceptions import ValidationError
 
+from apps.bookings import active_bookings
 from apps.models import Car
 
 
@@ -8,7 +12,16 @@ class CarFilter(FilterSet):
     price_max = NumberFilter(field_name='price', lookup_expr='lte')
     capacity = CharFilter(field_name='capacity', lookup_expr='exact')
     category = NumberFilter(field_name='category_id')
+    available = IsoDateTimeFromToRangeFilter(method='filter_available')
 
     class Meta:
         model = Car
-        fields = ('price_min', 'price_max', 'capacity', 'category')
+        fields = ('price_min', 'price_max', 'capacity', 'category', 'available')
+
+    def filter_available(self, queryset, name, value):
+        if value.start is None and value.stop is None:
+            return queryset
+        if value.start is not None and value.stop is not None and value.start >= value.stop:
+            raise ValidationError({'available_after': ['Must be earlier than available_before.']})
+        period = DateTimeTZRange(value.start, value.stop, '[)')
+        return queryset.filter(~Exists(active_bookings().filter(car=OuterRef('pk'), period__overlap=period)))
@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+from collections import Counter
+from pathlib import Path, PurePosixPath
+from zipfile import BadZipFile, ZipFile
+
+from django import forms
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+
+from apps.cache import bump_versions, model_version_name
+from apps.counters import change_car_amount
+from apps.outbox import enqueue_car_posts
+from apps.models import Car, CarImages, Category
+from apps.renditions import change_blob_refs
+from apps.search import car_search_vector
+from apps.storage import content_storage
+from apps.tasks import queue_renditions
+
+BATCH_SIZE = 500
+IMPORT_FORMATS = ('csv', 'jsonl')
+CAR_FIELDS = ('name', 'description', 'capacity', 'steering', 'gasoline', 'price')
+
+
+class ImageSource:
+    """Resolves image paths from an import row against a zip archive, a local directory or existing storage."""
+
+    def __init__(self, archive=None, base_dir=None):
+        try:
+            self.archive = ZipFile(archive) if archive is not None else None
+        except BadZipFile:
+            raise ValidationError('The images archive is not a valid zip file.')
+        self.members = set(self.archive.namelist()) if self.archive else set()
+        self.base_dir = Path(base_dir) if base_dir else None
+        self.checked = set()
+        self.saved = {}
+
+    def resolve(self, path):
+        """Normalize `path` and return it with its content, or with None when it already names a stored file."""
+        if not isinstance(path, str) or not path.strip():
+            raise ValidationError(f'Invalid image path: {path!r}')
+        relative = PurePosixPath(path.strip())
+        if relative.is_absolute() or '..' in relative.parts:
+            raise ValidationError(f'Image paths must be relative: {path}')
+        path = str(relative)
+        if path in self.members:
+            return path, ContentFile(self.archive.read(path), name=path)
+        if self.base_dir and (self.base_dir / path).is_file():
+            return path, File(open(self.base_dir / path, 'rb'), name=path)
+        try:
+            exists = content_storage.exists(path)
+        except SuspiciousFileOperation:
+            exists = False
+        if not exists:
+            raise ValidationError(f'Image not found: {path}')
+        return path, None
+
+    def check(self, path):
+        """Validate the image at `path` without storing anything, so rejected rows leave no files behind."""
+        path, content = self.resolve(path)
+        if content is None or path in self.checked:
+            return
+        with content:
+            try:
+                forms.ImageField().clean(content)
+            except ValidationError as e:
+                raise ValidationError([f'{path}: {message}' for message in e.messages])
+        self.checked.add(path)
+
+    def save(self, path, upload_to):
+        """Store a checked image and return its content-addressed name, storing each path once."""
+        path, content = self.resolve(path)
+        if content is None:
+            return path
+        with content:
+            if path not in self.saved:
+                self.saved[path] = content_storage.save(f'{upload_to}/{PurePosixPath(path).name}', content)
+        return self.saved[path]
+
+
+def read_rows(file, file_format):
+    """Yield (row number, row dict) from a binary CSV or JSON Lines file."""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            row['images'] = [path for path in (row.get('images') or '').split('|') if path.strip()]
+            yield number, row
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        yield number, row if isinstance(row, dict) else None
+
+
+def category_name(row):
+    name = row.get('category')
+    return name.strip() if isinstance(name, str) else ''
+
+
+def check_types(row):
+    """JSON Lines rows can carry any JSON value; reject the ones the model fields cannot take."""
+    errors = {}
+    for field in CAR_FIELDS:
+        value = row.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+            errors[field] = ['Must be a string or a number.']
+    for field in ('category', 'main_image'):
+        if row.get(field) is not None and not isinstance(row[field], str):
+            errors[field] = ['Must be a string.']
+    gallery = row.get('images')
+    if gallery is not None and not isinstance(gallery, str) and (
+        not isinstance(gallery, list) or not all(isinstance(path, str) for path in gallery)
+    ):
+        errors['images'] = ['Must be a list of strings.']
+    if errors:
+        raise ValidationError(errors)
+
+
+def build_car(row, categories, images):
+    if row is None:
+        raise ValidationError('Invalid JSON object.')
+    check_types(row)
+    category = categories.get(category_name(row))
+    if category is None:
+        raise ValidationError({'category': [f'Unknown category: {row.get("category")}']})
+
+    car = Car(category=category, **{field: row.get(field) for field in CAR_FIELDS if row.get(field) is not None})
+    car.full_clean(exclude=['category', 'main_image'], validate_unique=False, validate_constraints=False)
+    if not row.get('main_image'):
+        raise ValidationError({'main_image': ['This field is required.']})
+    gallery = row.get('images') or []
+    if isinstance(gallery, str):
+        gallery = [gallery]
+
+    for path in [row['main_image'], *gallery]:
+        images.check(path)
+
+    car.main_image = images.save(row['main_image'], 'main_images')
+    car.render_descriptions()
+    car.import_images = [images.save(path, 'cars') for path in gallery]
+    return car
+
+
+def save_batch(cars):
+    """
+    bulk_create skips the Car/CarImages signals, so their side effects are applied here once per batch:
+    search vectors, category counters, blob references, renditions, cache versions and the outbox rows.
+    """
+    with transaction.atomic():
+        Car.objects.bulk_create(cars)
+        car_ids = [car.pk for car in cars]
+        gallery = [
+            CarImages(car=car, images=name, position=position)
+            for car in cars for position, name in enumerate(car.import_images)
+        ]
+        CarImages.objects.bulk_create(gallery)
+
+        Car.objects.filter(pk__in=car_ids).update(search_vector=car_search_vector())
+        for category_id, total in Counter(car.category_id for car in cars).items():
+            change_car_amount(category_id, total)
+        change_blob_refs([car.main_image.name for car in cars] + [image.images.name for image in gallery], 1)
+        queue_renditions(cars, 'main_image')
+        queue_renditions(gallery, 'images')
+        bump_versions(model_version_name(Car), model_version_name(CarImages))
+        enqueue_car_posts(car_ids)
+
+
+def import_cars(file, file_format, archive=None, base_dir=None, batch_size=BATCH_SIZE):
+    rows = list(read_rows(file, file_format))
+    names = {category_name(row) for _, row in rows if row}
+    categories = {category.name: category for category in Category.objects.filter(name__in=names)}
+    images = ImageSource(archive, base_dir)
+
+    created, errors, batch = 0, [], []
+    for number, row in rows:
+        try:
+            batch.append(build_car(row, categories, images))
+        except ValidationError as e:
+            errors.append({'row': number, 'errors': e.message_dict if hasattr(e, 'error_dict') else e.messages})
+            continue
+        if len(batch) >= batch_size:
+            save_batch(batch)
+            created, batch = created + len(batch), []
+    if batch:
+        save_batch(batch)
+        created += len(batch)
+    return {'created': created, 'errors': errors}
@@ -0,0 +1,74 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from apps.bookings import create_booking
+from apps.models import Car, Location, RentByBot
+
+BENCH_NAME = '__booking_benchmark__'
+
+
+class Command(BaseCommand):
+    help = 'Measure booking throughput when many workers compete for the same car'
+
+    def add_arguments(self, parser):
+        parser.add_argument('car_id', type=int)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=50, help='Booking attempts per worker')
+        parser.add_argument('--days', type=int, default=60, help='Width of the contended date window')
+
+    def handle(self, *args, car_id, workers, attempts, days, **options):
+        car = Car.objects.get(pk=car_id)
+        location = Location.objects.first()
+        if location is None:
+            self.stderr.write('At least one Location is required.')
+            return
+        # Far in the future so real bookings never collide with the benchmark.
+        window_start = (timezone.localdate() + timedelta(days=365 * 5))
+
+        def worker(seed):
+            rng = random.Random(seed)
+            created = conflicts = 0
+            try:
+                for _ in range(attempts):
+                    pickup = window_start + timedelta(days=rng.randrange(days))
+                    dropoff = pickup + timedelta(days=rng.randint(1, 3))
+                    try:
+                        create_booking(
+                            RentByBot, car=car, name=BENCH_NAME, phone='0', tg_user_id=0,
+                            pickup_location=location, pickup_date=pickup, pickup_time='10:00',
+                            dropoff_location=location, dropoff_date=dropoff, dropoff_time='10:00',
+                        )
+                        created += 1
+                    except APIException:
+                        conflicts += 1
+            finally:
+                connection.close()
+            return created, conflicts
+
+        bench_bookings = RentByBot.objects.filter(car=car, name=BENCH_NAME)
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(worker, range(workers)))
+            elapsed = time.perf_counter() - started
+            double_booked = bench_bookings.filter(
+                Exists(bench_bookings.filter(period__overlap=OuterRef('period')).exclude(pk=OuterRef('pk')))
+            ).count()
+        finally:
+            bench_bookings.delete()
+
+        created = sum(result[0] for result in results)
+        conflicts = sum(result[1] for result in results)
+        total = created + conflicts
+        self.stdout.write(
+            f'workers={workers} attempts={total} created={created} conflicts={conflicts} '
+            f'elapsed={elapsed:.2f}s throughput={total / elapsed:.1f} attempts/s double_booked={double_booked}'
+        )
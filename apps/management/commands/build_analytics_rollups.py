@@ -0,0 +1,21 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.analytics import rollup_days
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily rental rollups for a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date_from', type=date.fromisoformat)
+        parser.add_argument('date_to', type=date.fromisoformat)
+
+    def handle(self, *args, date_from, date_to, **options):
+        day = date_from
+        while day <= date_to:
+            chunk = [day + timedelta(days=offset) for offset in range(31) if day + timedelta(days=offset) <= date_to]
+            built = rollup_days(chunk)
+            self.stdout.write(f'{chunk[0]}..{chunk[-1]}: {built} rows')
+            day = chunk[-1] + timedelta(days=1)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.renditions import RENDITION_FIELDS
+from apps.tasks import generate_renditions
+
+
+class Command(BaseCommand):
+    help = 'Queue rendition builds for every image that has none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Queue images that already have renditions too')
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model, fields in RENDITION_FIELDS.items():
+            for field, target in fields.items():
+                queryset = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                if not options['force']:
+                    queryset = queryset.filter(**{target: []})
+                for pk, name in queryset.values_list('pk', field).iterator():
+                    generate_renditions.delay(model._meta.label, pk, field, name)
+                    queued += 1
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} images'))
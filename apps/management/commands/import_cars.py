@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.imports import BATCH_SIZE, IMPORT_FORMATS, import_cars
+
+
+class Command(BaseCommand):
+    help = 'Bulk import cars from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path)
+        parser.add_argument('--archive', type=Path, help='Zip archive holding the images referenced by the rows')
+        parser.add_argument('--images-dir', type=Path, help='Directory image paths are relative to')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, path, archive, images_dir, batch_size, **options):
+        file_format = path.suffix.lstrip('.').lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError(f'File type must be one of: {", ".join(IMPORT_FORMATS)}.')
+
+        with open(path, 'rb') as file:
+            try:
+                report = import_cars(file, file_format, archive=archive, base_dir=images_dir, batch_size=batch_size)
+            except ValidationError as e:
+                raise CommandError(' '.join(e.messages))
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {report['created']} cars, {len(report['errors'])} rows failed"))
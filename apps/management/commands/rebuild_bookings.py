@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from apps.bookings import BOOKING_MODELS, sync_bookings, cross_channel_conflicts
+from apps.models import Booking, RentalOrder
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the unified Booking table from web and bot bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        for model in BOOKING_MODELS:
+            # Rows without a period (see update_booking_periods) or double booked across channels would violate
+            # the Booking constraints, they are reported and left out.
+            missing = sorted(model.objects.filter(period__isnull=True).values_list('pk', flat=True))
+            conflicts = sorted(cross_channel_conflicts(model).values_list('pk', flat=True))
+            if missing:
+                self.stderr.write(f'{model.__name__}: skipped bookings without a period: {missing}')
+            if conflicts:
+                self.stderr.write(f'{model.__name__}: skipped bookings overlapping the other channel: {conflicts}')
+
+            batch = []
+            rows = model.objects.filter(period__isnull=False).exclude(pk__in=conflicts).order_by('pk')
+            for instance in rows.iterator(chunk_size=batch_size):
+                batch.append(instance)
+                if len(batch) == batch_size:
+                    sync_bookings(batch)
+                    batch = []
+            if batch:
+                sync_bookings(batch)
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: synced'))
+
+        Booking.objects.filter(channel=Booking.Channel.WEB).update(
+            user_id=Subquery(RentalOrder.objects.filter(rental_id=OuterRef('source_id')).values('user_id')[:1])
+        )
+        self.stdout.write(self.style.SUCCESS('Web booking users linked'))
@@ -0,0 +1,32 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from apps.outbox import BATCH_SIZE, drain_outbox
+from bot.sender import get_bot
+
+
+class Command(BaseCommand):
+    help = 'Post queued car changes to the Telegram channel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--idle-sleep', type=float, default=2, help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+
+    def handle(self, *args, batch_size, idle_sleep, once, **options):
+        asyncio.run(self.run(batch_size, idle_sleep, once))
+
+    async def run(self, batch_size, idle_sleep, once):
+        bot = get_bot()
+        try:
+            while True:
+                claimed = await drain_outbox(bot, batch_size)
+                if claimed:
+                    self.stdout.write(f'Processed {claimed} cars')
+                elif once:
+                    break
+                else:
+                    await asyncio.sleep(idle_sleep)
+        finally:
+            await bot.session.close()
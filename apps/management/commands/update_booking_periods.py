@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.bookings import BOOKING_MODELS, booking_period_expression, invalid_periods, overlapping_periods
+
+
+class Command(BaseCommand):
+    help = 'Fill the timestamp range of bookings saved before it existed'
+
+    def handle(self, *args, **options):
+        for model in BOOKING_MODELS:
+            # Legacy rows may be inverted or double booked; they keep an empty period instead of failing the backfill.
+            invalid = sorted(invalid_periods(model).values_list('pk', flat=True))
+            overlapping = sorted(overlapping_periods(model).values_list('pk', flat=True))
+            if invalid:
+                self.stderr.write(f'{model.__name__}: skipped drop off not after pick up: {invalid}')
+            if overlapping:
+                self.stderr.write(f'{model.__name__}: skipped overlapping bookings: {overlapping}')
+
+            updated = (
+                model.objects.filter(period__isnull=True).exclude(pk__in=invalid + overlapping)
+                .update(period=booking_period_expression())
+            )
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: updated {updated} rows'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.cache import bump_versions, model_version_name
+from apps.models import Car, DESCRIPTION_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the sanitized HTML, plain-text and Telegram caption variants of every car description'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        batch, updated = [], 0
+        for car in Car.objects.only('id', 'description').iterator(chunk_size=batch_size):
+            car.render_descriptions()
+            batch.append(car)
+            if len(batch) >= batch_size:
+                updated += Car.objects.bulk_update(batch, DESCRIPTION_FIELDS)
+                batch = []
+        if batch:
+            updated += Car.objects.bulk_update(batch, DESCRIPTION_FIELDS)
+
+        bump_versions(model_version_name(Car))
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} cars'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from apps.models import Car
+from apps.search import car_search_vector
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vector of every car'
+
+    def handle(self, *args, **options):
+        updated = Car.objects.update(search_vector=car_search_vector())
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} cars'))
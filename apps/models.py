@@ -1,7 +1,18 @@
 from ckeditor.fields import RichTextField
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db.models import ImageField, Model, TextChoices, ForeignKey, CASCADE, DateTimeField, \
-    OneToOneField, DateField, TimeField, IntegerField
-from django.db.models.fields import CharField, BigIntegerField, PositiveIntegerField, BooleanField
+    OneToOneField, DateField, TimeField, IntegerField, Index, UniqueConstraint, SET_NULL, JSONField, Q, QuerySet
+from django.db.models.fields import CharField, BigIntegerField, PositiveIntegerField, BooleanField, FloatField, \
+    PositiveSmallIntegerField, TextField
+from django.utils.timezone import now
+
+from apps.descriptions import render_description, description_caption
+from apps.storage import content_storage
+
+DESCRIPTION_FIELDS = ('description_html', 'description_text', 'description_caption')
 
 
 class Region(Model):
@@ -37,25 +48,95 @@ class Car(Model):
 
     name = CharField(max_length=50)
     description = RichTextField()
+    description_html = TextField(default='', editable=False)
+    description_text = TextField(default='', editable=False)
+    description_caption = TextField(default='', editable=False)
     category = ForeignKey('apps.Category', on_delete=CASCADE, related_name='cars')
     capacity = CharField(max_length=10, choices=CapacityType.choices)
     steering = CharField(max_length=15, choices=SteeringType.choices)
     gasoline = CharField(max_length=255)
     price = PositiveIntegerField(default=0)
-    main_image = ImageField(upload_to='main_images/%Y/%m/%d/')
+    main_image = ImageField(upload_to='main_images/%Y/%m/%d/', storage=content_storage)
+    main_image_renditions = JSONField(default=list, editable=False)
     created_at = DateTimeField(auto_now_add=True)
     updated_at = DateTimeField(auto_now=True)
     telegram_message_id = BigIntegerField(null=True, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    review_count = PositiveIntegerField(default=0, editable=False)
+    rating_sum = PositiveIntegerField(default=0, editable=False)
+    rating_avg = FloatField(default=0, editable=False)
+    rating_1 = PositiveIntegerField(default=0, editable=False)
+    rating_2 = PositiveIntegerField(default=0, editable=False)
+    rating_3 = PositiveIntegerField(default=0, editable=False)
+    rating_4 = PositiveIntegerField(default=0, editable=False)
+    rating_5 = PositiveIntegerField(default=0, editable=False)
+    rental_count = PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            Index(fields=['created_at', 'id']),
+            Index(fields=['price', 'id']),
+            Index(fields=['rating_avg', 'id']),
+            Index(fields=['rental_count', 'id']),
+            GinIndex(fields=['search_vector']),
+        ]
+
+    @property
+    def rating_histogram(self):
+        return {str(stars): getattr(self, f'rating_{stars}') for stars in range(1, 6)}
+
+    def render_descriptions(self):
+        self.description_html, self.description_text = render_description(self.description)
+        self.description_caption = description_caption(self.description_text)
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None or 'description' in update_fields:
+            self.render_descriptions()
+            if update_fields is not None:
+                update_fields = {*update_fields, *DESCRIPTION_FIELDS}
+        super().save(*args, update_fields=update_fields, **kwargs)
 
     def __str__(self):
         return f'{self.name}'
 
 
+class CarImagesQuerySet(QuerySet):
+    def bulk_delete(self):
+        """
+        Delete the rows in one statement, without loading them or sending post_delete.
+        Callers release the image blobs themselves, e.g. with change_blob_refs(names, -1).
+        """
+        return self._raw_delete(self.db)
+
+
 class CarImages(Model):
-    images = ImageField(upload_to='cars/%Y/%m/%d/')
+    images = ImageField(upload_to='cars/%Y/%m/%d/', storage=content_storage)
+    renditions = JSONField(default=list, editable=False)
     car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='carimages_set')
+    position = PositiveIntegerField(default=0)
     created_at = DateTimeField(auto_now_add=True)
     updated_at = DateTimeField(auto_now=True)
+    objects = CarImagesQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('position', 'id')
+        indexes = [
+            Index(fields=['car', 'position', 'id']),
+        ]
+
+
+class ImageBlob(Model):
+    name = CharField(max_length=255, unique=True)
+    ref_count = IntegerField(default=0)
+    renditions = JSONField(default=list)
+    telegram_file_id = CharField(max_length=255, blank=True, default='')
+    created_at = DateTimeField(auto_now_add=True)
+    updated_at = DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            Index(fields=['ref_count', 'updated_at']),
+        ]
 
 
 class Review(Model):
@@ -67,6 +148,7 @@ class Review(Model):
         ONE = '1', 'One'
 
     stars = CharField(max_length=10, choices=StarsNumber.choices)
+    rating = PositiveSmallIntegerField(default=0, editable=False)
     user = ForeignKey('authentication.User', on_delete=CASCADE, related_name='reviews')
     text = RichTextField()
     car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='reviews')
@@ -74,6 +156,12 @@ class Review(Model):
     updated_at = DateTimeField(auto_now=True)
     is_edited = BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            Index(fields=['user', 'created_at', 'id']),
+            Index(fields=['car', 'created_at', 'id']),
+        ]
+
 
 class BillingInfo(Model):
     user = ForeignKey('authentication.User', on_delete=CASCADE)
@@ -100,6 +188,15 @@ class RentalInfo(Model):
     dropoff_location = ForeignKey('apps.Location', on_delete=CASCADE, related_name='dropoff_locations')
     dropoff_date = DateField()
     dropoff_time = TimeField()
+    period = DateTimeRangeField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            ExclusionConstraint(
+                name='rentalinfo_car_period_excl',
+                expressions=[('car', RangeOperators.EQUAL), ('period', RangeOperators.OVERLAPS)],
+            ),
+        ]
 
     def __str__(self):
         return f"{self.car} | {self.pickup_location} → {self.dropoff_location}"
@@ -129,6 +226,11 @@ class RentalOrder(Model):
     # payment = OneToOneField(PaymentInfo, on_delete=CASCADE)
     created_at = DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            Index(fields=['user', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} by {self.user}"
 
@@ -150,7 +252,122 @@ class RentByBot(Model):
                                choices=[("pending", "pending"), ("paid", "paid"), ("failed", "failed")])
     paid_amount = IntegerField(blank=True, null=True)
     paid_currency = CharField(max_length=10, blank=True, null=True)
+    # Paid after the booking expired and its slot was taken; the charge has to be refunded.
+    refund_due = BooleanField(default=False)
+    updated_at = DateTimeField(auto_now=True, null=True)
+    period = DateTimeRangeField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            ExclusionConstraint(
+                name='rentbybot_car_period_excl',
+                expressions=[('car', RangeOperators.EQUAL), ('period', RangeOperators.OVERLAPS)],
+                # Abandoned card payments are marked failed and stop holding the car.
+                condition=~Q(payment_status='failed'),
+            ),
+        ]
 
 
 def __str__(self):
     return f"{self.name} (Car {self.car_id})"
+
+
+class CarRentalStat(Model):
+    car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='rental_stats')
+    day = DateField()
+    rental_count = PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['car', 'day'], name='carrentalstat_car_day_uniq'),
+        ]
+        indexes = [
+            Index(fields=['day', 'car', 'rental_count']),
+        ]
+
+
+class Booking(Model):
+    class Channel(TextChoices):
+        WEB = 'web', 'Web'
+        BOT = 'bot', 'Bot'
+
+    channel = CharField(max_length=3, choices=Channel.choices)
+    source_id = BigIntegerField()
+    car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='bookings')
+    pickup_location = ForeignKey('apps.Location', on_delete=CASCADE, related_name='pickup_bookings')
+    dropoff_location = ForeignKey('apps.Location', on_delete=CASCADE, related_name='dropoff_bookings')
+    pickup_at = DateTimeField()
+    dropoff_at = DateTimeField()
+    period = DateTimeRangeField()
+    payment_status = CharField(max_length=20, default='pending')
+    user = ForeignKey('authentication.User', on_delete=SET_NULL, null=True, blank=True, related_name='bookings')
+    tg_user_id = BigIntegerField(null=True, blank=True)
+    created_at = DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['channel', 'source_id'], name='booking_channel_source_uniq'),
+            ExclusionConstraint(
+                name='booking_car_period_excl',
+                expressions=[('car', RangeOperators.EQUAL), ('period', RangeOperators.OVERLAPS)],
+                # Abandoned card payments are marked failed and stop holding the car.
+                condition=~Q(payment_status='failed'),
+            ),
+        ]
+        indexes = [
+            Index(fields=['pickup_at', 'id']),
+            Index(fields=['car', 'pickup_at']),
+            Index(fields=['user', 'pickup_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} #{self.source_id} (Car {self.car_id})"
+
+
+class DailyRentalStat(Model):
+    day = DateField()
+    channel = CharField(max_length=3, choices=Booking.Channel.choices)
+    car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='daily_stats')
+    category = ForeignKey('apps.Category', on_delete=CASCADE, related_name='daily_stats')
+    pickup_location = ForeignKey('apps.Location', on_delete=CASCADE, related_name='daily_stats')
+    rentals = PositiveIntegerField(default=0)
+    paid_rentals = PositiveIntegerField(default=0)
+    revenue = BigIntegerField(default=0)  # paid amount in minor currency units, as Telegram reports it
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['day', 'channel', 'car', 'pickup_location'], name='dailyrentalstat_uniq'),
+        ]
+
+
+class TelegramOutbox(Model):
+    """
+    Pending Telegram message about a car, written in the car's transaction and drained by run_telegram_outbox:
+    the channel post when chat_id is empty, otherwise a notification to that customer.
+    """
+
+    class Status(TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        FAILED = 'failed', 'Failed'
+
+    car = ForeignKey('apps.Car', on_delete=CASCADE, related_name='telegram_outbox')
+    chat_id = BigIntegerField(null=True, blank=True)
+    status = CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = PositiveSmallIntegerField(default=0)
+    available_at = DateTimeField(default=now)
+    last_error = TextField(blank=True, default='')
+    created_at = DateTimeField(auto_now_add=True)
+    updated_at = DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # One pending row per car and chat: further edits coalesce into it.
+            UniqueConstraint(
+                fields=['car', 'chat_id'], condition=Q(status='pending'), nulls_distinct=False,
+                name='telegramoutbox_car_pending_uniq',
+            ),
+        ]
+        indexes = [
+            Index(fields=['status', 'available_at']),
+        ]
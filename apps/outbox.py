@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.models import Car, TelegramOutbox
+from bot.sender import post_car, notify_customer
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+# A row left in processing this long belongs to a worker that died mid-batch.
+PROCESSING_LEASE = timedelta(minutes=10)
+# Telegram allows about 20 messages a minute per channel.
+SEND_INTERVAL = 3
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_car_posts(car_ids):
+    """Queue a channel post for each car; cars that already have a pending one coalesce into it."""
+    TelegramOutbox.objects.bulk_create(
+        [TelegramOutbox(car_id=car_id) for car_id in car_ids], ignore_conflicts=True
+    )
+
+
+def enqueue_customer_notifications(car_id, chat_ids):
+    """Queue a message about the car to each customer chat."""
+    TelegramOutbox.objects.bulk_create(
+        [TelegramOutbox(car_id=car_id, chat_id=chat_id) for chat_id in chat_ids], ignore_conflicts=True
+    )
+
+
+def claim_batch(size=BATCH_SIZE):
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            TelegramOutbox.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=TelegramOutbox.Status.PENDING, available_at__lte=now)
+                | Q(status=TelegramOutbox.Status.PROCESSING, updated_at__lt=now - PROCESSING_LEASE)
+            )
+            .order_by('available_at', 'id')[:size]
+        )
+        TelegramOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            status=TelegramOutbox.Status.PROCESSING, updated_at=now
+        )
+    # A car can be claimed twice when a stale processing row is picked up next to its pending one.
+    cars = Car.objects.select_related('category').in_bulk({row.car_id for row in rows})
+    # The car may have been deleted since its rows were claimed; there is nothing left to post.
+    complete([row for row in rows if row.car_id not in cars])
+    claimed = {}
+    for row in rows:
+        if row.car_id in cars:
+            claimed.setdefault((row.car_id, row.chat_id), (cars[row.car_id], []))[1].append(row)
+    return list(claimed.values())
+
+
+def complete(rows):
+    TelegramOutbox.objects.filter(pk__in=[row.pk for row in rows]).delete()
+
+
+def retry(rows, error, delay=None, count_attempt=True):
+    row, duplicates = rows[0], rows[1:]
+    attempts = row.attempts + (1 if count_attempt else 0)
+    if delay is None:
+        delay = min(BACKOFF_BASE * 2 ** attempts, BACKOFF_MAX)
+    complete(duplicates)
+    try:
+        with transaction.atomic():
+            TelegramOutbox.objects.filter(pk=row.pk).update(
+                status=TelegramOutbox.Status.FAILED if attempts >= MAX_ATTEMPTS else TelegramOutbox.Status.PENDING,
+                attempts=attempts,
+                available_at=timezone.now() + timedelta(seconds=delay),
+                last_error=str(error)[:1000],
+                updated_at=timezone.now(),
+            )
+    except IntegrityError:
+        # A newer pending row for the car already carries the latest state, this one is redundant.
+        complete([row])
+
+
+async def drain_outbox(bot, size=BATCH_SIZE):
+    """Post one claimed batch, returns how many cars were claimed."""
+    batch = await sync_to_async(claim_batch)(size)
+    for index, (car, rows) in enumerate(batch):
+        chat_id = rows[0].chat_id
+        try:
+            if chat_id is None:
+                await post_car(bot, car)
+            else:
+                await notify_customer(bot, chat_id, car)
+        except TelegramRetryAfter as e:
+            # Flood control is per bot: put the rest of the batch back and wait it out.
+            for _, pending in batch[index:]:
+                await sync_to_async(retry)(pending, e, delay=e.retry_after, count_attempt=False)
+            await asyncio.sleep(e.retry_after)
+            break
+        except TelegramForbiddenError as e:
+            # The customer blocked the bot, retrying cannot help.
+            logger.info('Dropping notification about car %s to chat %s: %s', car.pk, chat_id, e)
+            await sync_to_async(complete)(rows)
+        except Exception as e:
+            # Any failure is scoped to this message; the rest of the batch still gets sent.
+            logger.warning('Telegram message about car %s to %s failed: %s', car.pk, chat_id or 'channel', e)
+            await sync_to_async(retry)(rows, e)
+        else:
+            await sync_to_async(complete)(rows)
+        await asyncio.sleep(SEND_INTERVAL)
+    return len(batch)
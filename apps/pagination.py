@@ -0,0 +1,178 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import date, datetime, time
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, (date, datetime, time)) else v for v in values]
+    return urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (BinasciiError, UnicodeError, ValueError):
+        raise NotFound('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != size:
+        raise NotFound('Invalid cursor.')
+    return values
+
+
+def coerce_cursor(queryset, ordering, values):
+    """Convert decoded cursor values to the types of their ordering fields, rejecting crafted cursors."""
+    coerced = []
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        if name in queryset.query.annotations:
+            model_field = queryset.query.annotations[name].output_field
+        else:
+            try:
+                model_field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise NotFound('Invalid cursor.')
+        if value is None or isinstance(value, (list, dict)):
+            raise NotFound('Invalid cursor.')
+        try:
+            coerced.append(model_field.to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound('Invalid cursor.')
+    return coerced
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the "rows after `values`" condition for `ordering`, e.g. for ('-created_at', '-id'):
+    created_at <= v1 AND (created_at < v1 OR (created_at = v1 AND id < v2)).
+    The leading non-strict bound lets the database use it as an index range condition.
+    """
+    condition = None
+    for field, value in reversed(list(zip(ordering, values))):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        strict = Q(**{f'{name}__{lookup}': value})
+        condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique composite key such as (created_at, id).
+    Views pick the available orderings with `keyset_orderings`, the first entry is the default.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    orderings = {
+        '-created_at': ('-created_at', '-id'),
+    }
+
+    def get_orderings(self, view):
+        return getattr(view, 'keyset_orderings', self.orderings)
+
+    def get_ordering(self, request, queryset, view):
+        orderings = self.get_orderings(view)
+        key = request.query_params.get(self.ordering_query_param)
+        if key is None:
+            # Search results come ranked by relevance unless another ordering is asked for.
+            if 'rank' in orderings and 'rank' in queryset.query.annotations:
+                return orderings['rank']
+            return next(iter(orderings.values()))
+        if key not in orderings or (key == 'rank' and 'rank' not in queryset.query.annotations):
+            raise NotFound('Invalid ordering.')
+        return orderings[key]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = coerce_cursor(queryset, self.ordering, decode_cursor(cursor, len(self.ordering)))
+            queryset = queryset.filter(keyset_filter(self.ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(values))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.ordering_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Which field to use when ordering the results.',
+                'schema': {'type': 'string', 'enum': list(self.get_orderings(view))},
+            },
+        ]
+
+
+class RecentTransactionPagination(KeysetPagination):
+    page_size = 5
+    orderings = {
+        '-pickup_at': ('-pickup_at', '-id'),
+    }
@@ -0,0 +1,103 @@
+from collections import Counter
+from io import BytesIO
+from os.path import splitext
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+from rest_framework.fields import ReadOnlyField
+
+from apps.models import Car, CarImages, ImageBlob
+from apps.storage import content_storage
+from authentication.models import User
+
+RENDITION_WIDTHS = (320, 640, 1280)
+RENDITION_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+RENDITIONS_DIR = 'renditions'
+# Image field -> JSON field holding its renditions, per model.
+RENDITION_FIELDS = {
+    Car: {'main_image': 'main_image_renditions'},
+    CarImages: {'images': 'renditions'},
+    User: {'avatar': 'avatar_renditions'},
+}
+
+
+def file_name(instance, field):
+    """Name of the file currently assigned to `field`, without loading a deferred field."""
+    if field not in instance.__dict__:
+        return None
+    value = instance.__dict__[field]
+    return getattr(value, 'name', value) or ''
+
+
+def build_renditions(field_file):
+    """Save every width/format rendition of `field_file` under renditions/<original name>/ and describe them."""
+    stem = splitext(field_file.name)[0]
+    with field_file.open('rb') as source, Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        widths = [width for width in RENDITION_WIDTHS if width < image.width] or [image.width]
+        renditions = []
+        for width in widths:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            for ext, options in RENDITION_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, **options)
+                name = f'{RENDITIONS_DIR}/{stem}/{width}.{ext}'
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+                renditions.append({'name': name, 'width': width, 'height': height, 'format': ext})
+    return renditions
+
+
+def delete_renditions(renditions):
+    for rendition in renditions:
+        default_storage.delete(rendition['name'])
+
+
+def change_blob_refs(names, delta):
+    """Add `delta` references per occurrence of each name in one statement, creating missing blobs."""
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    table = ImageBlob._meta.db_table
+    with connection.cursor() as cursor:
+        if delta > 0:
+            cursor.execute(f"""
+                INSERT INTO {table} (name, ref_count, renditions, telegram_file_id, created_at, updated_at)
+                SELECT c.name, c.total * %s, '[]', '', now(), now()
+                FROM unnest(%s::varchar[], %s::integer[]) AS c(name, total)
+                ON CONFLICT (name) DO UPDATE
+                SET ref_count = {table}.ref_count + EXCLUDED.ref_count, updated_at = EXCLUDED.updated_at
+            """, [delta, list(counts), list(counts.values())])
+        else:
+            cursor.execute(f"""
+                UPDATE {table} AS b SET ref_count = b.ref_count + c.total * %s, updated_at = now()
+                FROM unnest(%s::varchar[], %s::integer[]) AS c(name, total)
+                WHERE b.name = c.name
+            """, [delta, list(counts), list(counts.values())])
+
+
+def delete_blob(blob):
+    content_storage.delete(blob.name)
+    delete_renditions(blob.renditions)
+
+
+class SrcsetField(ReadOnlyField):
+    """Renders stored renditions as one `srcset` string per format, e.g. {"webp": "/a/320.webp 320w, ..."}."""
+
+    def to_representation(self, renditions):
+        request = self.context.get('request')
+        srcset = {}
+        for rendition in renditions or ():
+            url = default_storage.url(rendition['name'])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            srcset.setdefault(rendition['format'], []).append(f"{url} {rendition['width']}w")
+        return {ext: ', '.join(candidates) for ext, candidates in srcset.items()}
@@ -0,0 +1,57 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, Func, OuterRef, Subquery, TextField
+from django.db.models.functions import Cast
+from rest_framework.filters import BaseFilterBackend
+
+from apps.models import Category
+
+SEARCH_CONFIG = 'simple'
+
+
+class StripTags(Func):
+    function = 'regexp_replace'
+    template = "%(function)s(%(expressions)s, '<[^>]*>', ' ', 'g')"
+    output_field = TextField()
+
+
+def car_search_vector():
+    category_name = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+    return (
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(category_name, weight='B', config=SEARCH_CONFIG)
+            + SearchVector(StripTags('description'), weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def build_search_query(terms: str):
+    words = re.findall(r'\w+', terms)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+class CarSearchFilter(BaseFilterBackend):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = build_search_query(request.query_params.get(self.search_param, ''))
+        if query is None:
+            return queryset
+        return (
+            queryset
+            .filter(search_vector=query)
+            .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Full-text search over name, category and description.',
+                'schema': {'type': 'string'},
+            },
+        ]
@@ -1,12 +1,20 @@
 import re
 
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.timezone import localtime
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import CharField
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
 from apps.models import Category, Car, Review, CarImages, BillingInfo, RentalInfo, RentalOrder, Region, District, \
-    RentByBot
+    RentByBot, Booking
+from apps.bookings import create_booking
+from apps.cache import bump_versions, model_version_name
+from apps.renditions import SrcsetField, change_blob_refs
+from apps.storage import content_storage
+from apps.tasks import queue_renditions
 from authentication.serializers import UserModelSerializer
 
 
@@ -51,47 +59,120 @@ class ReviewUpdateModelSerializer(ReviewModelSerializer):
 
 
 class CarImagesModelSerializer(ModelSerializer):
+    images_srcset = SrcsetField(source='renditions')
+
     class Meta:
         model = CarImages
-        fields = ('images', 'car')
-        read_only_fields = ('id', 'created_at', 'updated_at')
+        fields = ('id', 'images', 'images_srcset', 'car', 'position')
+        read_only_fields = ('id', 'position', 'created_at', 'updated_at')
+
+
+class GalleryItemField(serializers.Field):
+    default_error_messages = {
+        'invalid': 'Expected the id of one of the car\'s images or an image upload.',
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.image_field = serializers.ImageField()
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'read'):
+            return self.image_field.run_validation(data)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('invalid')
+
+    def to_representation(self, value):
+        return value
 
 
 class CarModelSerializer(ModelSerializer):
-    reviews = ReviewModelSerializer(many=True, read_only=True)
     carimages_set = CarImagesModelSerializer(many=True, read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    main_image_srcset = SrcsetField(source='main_image_renditions')
+    gallery = serializers.ListField(
+        child=GalleryItemField(), write_only=True, required=False,
+        help_text='Full ordered gallery of kept image ids and new uploads, e.g. gallery[0]=12, gallery[1]=<file>.'
+    )
 
     class Meta:
         model = Car
         fields = (
-            'name', 'description', 'category', 'capacity', 'steering',
-            'gasoline', 'price', 'main_image', 'reviews', 'carimages_set'
+            'name', 'description', 'description_html', 'description_text', 'category', 'capacity', 'steering',
+            'gasoline', 'price', 'main_image', 'main_image_srcset', 'carimages_set',
+            'review_count', 'rating_avg', 'rating_histogram', 'gallery'
+        )
+        read_only_fields = ('id', 'created_at', 'updated_at', 'telegram_message_id', 'carimages_set',
+                            'review_count', 'rating_avg', 'description_html', 'description_text')
+        # The raw CKEditor markup is only accepted, clients render the sanitized or plain variants.
+        extra_kwargs = {'description': {'write_only': True}}
+
+    @staticmethod
+    def get_prefetches(prefix=''):
+        # Reviews are paged separately from cars/<pk>/reviews.
+        return (
+            Prefetch(f'{prefix}carimages_set'),
         )
-        read_only_fields = ('id', 'created_at', 'updated_at', 'telegram_message_id', 'carimages_set')
 
     def validate_price(self, value):
         if value < 0:
             raise ValidationError('The car price cannot be negative!')
         return value
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['reviews'] = ReviewModelSerializer(instance.reviews.all(), many=True).data
-        data['carimages_set'] = CarImagesModelSerializer(
-            instance.carimages_set.all(),
-            many=True
-        ).data
-        return data
+    def validate_gallery(self, value):
+        if self.instance is None and any(isinstance(item, int) for item in value):
+            raise ValidationError('A new car can only have uploaded images.')
+        return value
+
+    @staticmethod
+    def save_gallery(car, gallery, existing=()):
+        """
+        Apply `gallery` as a diff against the car's `existing` images: listed ids are kept at their new position,
+        uploads identical to an existing image reuse it, everything else is bulk inserted and the rest deleted.
+        """
+        existing = {image.pk: image for image in existing}
+        by_name = {image.images.name: image for image in existing.values()}
+        kept, added, moved = {}, [], []
+        for position, item in enumerate(gallery):
+            if isinstance(item, int):
+                if item not in existing:
+                    raise ValidationError({'gallery': [f'Image {item} does not belong to this car.']})
+                image = existing[item]
+            else:
+                image = by_name.get(content_storage.content_name(item.name, item))
+            if image is None or image.pk in kept:
+                added.append(CarImages(car=car, images=item if image is None else image.images, position=position))
+                continue
+            kept[image.pk] = image
+            if image.position != position:
+                image.position = position
+                moved.append(image)
+
+        removed = [image for pk, image in existing.items() if pk not in kept]
+        if removed:
+            # bulk_delete skips the per-row post_delete receivers, their side effects are applied in bulk here.
+            CarImages.objects.filter(pk__in=[image.pk for image in removed]).bulk_delete()
+            change_blob_refs([image.images.name for image in removed], -1)
+        if moved:
+            CarImages.objects.bulk_update(moved, ['position'])
+        if added:
+            CarImages.objects.bulk_create(added)
+            change_blob_refs([image.images.name for image in added], 1)
+            queue_renditions(added, 'images')
+        if removed or moved or added:
+            bump_versions(model_version_name(CarImages))
 
     def create(self, validated_data):
-        carimages_data = validated_data.pop('carimages_set', [])
-        car = Car.objects.create(**validated_data)
-        for image_data in carimages_data:
-            CarImages.objects.create(car=car, **image_data)
+        gallery = validated_data.pop('gallery', [])
+        with transaction.atomic():
+            car = Car.objects.create(**validated_data)
+            self.save_gallery(car, gallery)
         return car
 
     def update(self, instance, validated_data):
-        carimages_data = validated_data.pop('carimages_set', [])
+        gallery = validated_data.pop('gallery', None)
         instance.name = validated_data.get('name', instance.name)
         instance.description = validated_data.get('description', instance.description)
         instance.category = validated_data.get('category', instance.category)
@@ -100,12 +181,11 @@ class CarModelSerializer(ModelSerializer):
         instance.gasoline = validated_data.get('gasoline', instance.gasoline)
         instance.price = validated_data.get('price', instance.price)
         instance.main_image = validated_data.get('main_image', instance.main_image)
-        instance.save()
 
-        if carimages_data:
-            instance.carimages_set.all().delete()
-            for image_data in carimages_data:
-                CarImages.objects.create(car=instance, **image_data)
+        with transaction.atomic():
+            instance.save()
+            if gallery is not None:
+                self.save_gallery(instance, gallery, CarImages.objects.filter(car=instance).select_for_update())
 
         return instance
 
@@ -145,6 +225,11 @@ class RentalInfoModelSerializer(serializers.ModelSerializer):
                   )
         read_only_fields = ('id',)
 
+    def validate(self, attrs):
+        if (attrs['dropoff_date'], attrs['dropoff_time']) <= (attrs['pickup_date'], attrs['pickup_time']):
+            raise ValidationError('Drop off must be after pick up.')
+        return attrs
+
 
 # class PaymentModelSerializer(serializers.ModelSerializer):
 #     class Meta:
@@ -191,34 +276,56 @@ class RentalOrderSerializer(serializers.ModelSerializer):
 
         user = self.context["request"].user
 
-        billing = BillingInfo.objects.create(user=user, **billing_data)
-        rental = RentalInfo.objects.create(**rental_data)
-        # payment = PaymentInfo.objects.create(**payment_data)
+        with transaction.atomic():
+            billing = BillingInfo.objects.create(user=user, **billing_data)
+            rental = create_booking(RentalInfo, **rental_data)
+            # payment = PaymentInfo.objects.create(**payment_data)
 
-        order = RentalOrder.objects.create(
-            user=user,
-            billing=billing,
-            rental=rental,
-            # payment=payment
-        )
+            order = RentalOrder.objects.create(
+                user=user,
+                billing=billing,
+                rental=rental,
+                # payment=payment
+            )
         return order
 
 
 class RecentTransactionSerializer(ModelSerializer):
     car_name = CharField(source="car.name")
     car_category = CharField(source="car.category.name")
+    pickup_date = SerializerMethodField()
+    pickup_time = SerializerMethodField()
+    dropoff_date = SerializerMethodField()
+    pickup_location_name = CharField(source="pickup_location.name")
+    dropoff_location_name = CharField(source="dropoff_location.name")
 
     class Meta:
-        model = RentalInfo
+        model = Booking
         fields = (
+            "channel",
             "car_name",
             "car_category",
+            "pickup_at",
+            "dropoff_at",
             "pickup_date",
+            "pickup_time",
             "dropoff_date",
             "pickup_location",
+            "pickup_location_name",
             "dropoff_location",
+            "dropoff_location_name",
+            "payment_status",
         )
 
+    def get_pickup_date(self, obj):
+        return localtime(obj.pickup_at).date()
+
+    def get_pickup_time(self, obj):
+        return localtime(obj.pickup_at).time().replace(tzinfo=None)
+
+    def get_dropoff_date(self, obj):
+        return localtime(obj.dropoff_at).date()
+
 
 class RegionModelSerializer(ModelSerializer):
     class Meta:
@@ -1,12 +1,32 @@
-import asyncio
-
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_save, post_delete, post_init, pre_save
 from django.dispatch import receiver
 
-from apps.models import Car, RentByBot
-from bot.buttons import keyboard
-from bot.loader import bot
-from bot.sender import send_car_to_channel, update_car_post
+from apps.bookings import booking_period, car_booking_version_name, booking_day, change_rental_count, \
+    sync_bookings, BOOKING_CHANNELS
+from apps.analytics import mark_touched_days
+from apps.cache import bump_versions, model_version_name
+from apps.counters import change_car_amount
+from apps.outbox import enqueue_car_posts, enqueue_customer_notifications
+from apps.renditions import RENDITION_FIELDS, file_name, change_blob_refs
+from apps.models import Car, RentByBot, Category, CarImages, Review, Region, District, RentalInfo, Booking, \
+    RentalOrder, Location, TelegramOutbox
+from apps.search import car_search_vector
+from apps.tasks import queue_renditions
+from authentication.models import User
+
+CACHED_MODELS = (Category, Car, CarImages, Review, Region, District, User, RentalInfo, RentByBot, Location)
+
+
+@receiver([post_save, post_delete])
+def bump_cache_version(sender, update_fields=None, **kwargs):
+    if sender not in CACHED_MODELS:
+        return
+    if sender is User and update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+    bump_versions(model_version_name(sender))
 
 
 @receiver(post_save, sender=Car)
@@ -16,33 +36,216 @@ def send_or_update_car(sender, instance: Car, created: bool, update_fields=None,
         if uf == {"telegram_message_id"}:
             return
 
+    # Cars are only posted once on creation; later saves edit the post, or the one still waiting to be sent.
+    if created or instance.telegram_message_id or TelegramOutbox.objects.filter(car=instance, chat_id=None).exists():
+        enqueue_car_posts([instance.pk])
+
+
+@receiver(post_init, sender=Car)
+def remember_car_category(sender, instance: Car, **kwargs):
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+
+
+@receiver(post_save, sender=Car)
+def update_category_car_amount(sender, instance: Car, created: bool, **kwargs):
+    old_category_id = None if created else instance._loaded_category_id
+    if old_category_id == instance.category_id:
+        return
+    with transaction.atomic():
+        if old_category_id:
+            change_car_amount(old_category_id, -1)
+        change_car_amount(instance.category_id, 1)
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Car)
+def decrease_category_car_amount(sender, instance: Car, **kwargs):
+    change_car_amount(instance.category_id, -1)
+
+
+def change_car_rating(car_id, old_rating=None, new_rating=None):
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    changes = {
+        'review_count': F('review_count') + count_delta,
+        'rating_sum': F('rating_sum') + sum_delta,
+        'rating_avg': Coalesce(
+            Cast(F('rating_sum') + sum_delta, FloatField()) / NullIf(F('review_count') + count_delta, 0), 0.0
+        ),
+    }
+    if old_rating != new_rating:
+        if old_rating:
+            changes[f'rating_{old_rating}'] = F(f'rating_{old_rating}') - 1
+        if new_rating:
+            changes[f'rating_{new_rating}'] = F(f'rating_{new_rating}') + 1
+    Car.objects.filter(pk=car_id).update(**changes)
+
+
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance: Review, **kwargs):
+    instance._loaded_rating = (instance.__dict__.get('car_id'), instance.__dict__.get('rating'))
+
+
+@receiver(pre_save, sender=Review)
+def set_review_rating(sender, instance: Review, **kwargs):
+    instance.rating = int(instance.stars)
+
+
+@receiver(post_save, sender=Review)
+def update_car_rating(sender, instance: Review, created: bool, **kwargs):
+    loaded_car_id, loaded_rating = (None, None) if created else instance._loaded_rating
+    current = (instance.car_id, instance.rating)
+    if (loaded_car_id, loaded_rating) == current:
+        return
+    with transaction.atomic():
+        if loaded_car_id == instance.car_id:
+            change_car_rating(instance.car_id, loaded_rating or None, instance.rating)
+        else:
+            if loaded_car_id:
+                change_car_rating(loaded_car_id, old_rating=loaded_rating or None)
+            change_car_rating(instance.car_id, new_rating=instance.rating)
+    instance._loaded_rating = current
+
+
+@receiver(post_delete, sender=Review)
+def remove_car_rating(sender, instance: Review, **kwargs):
+    change_car_rating(instance.car_id, old_rating=instance.rating or None)
+
+
+@receiver(post_save, sender=Car)
+def update_car_search_vector(sender, instance: Car, created: bool, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'description', 'category', 'category_id'} & set(update_fields):
+        return
+    Car.objects.filter(pk=instance.pk).update(search_vector=car_search_vector())
+
+
+@receiver(post_save, sender=Category)
+def update_category_cars_search_vector(sender, instance: Category, created: bool, update_fields=None, **kwargs):
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    if not created:
+        Car.objects.filter(category=instance).update(search_vector=car_search_vector())
+
+
+@receiver(pre_save, sender=RentalInfo)
+@receiver(pre_save, sender=RentByBot)
+def set_booking_period(sender, instance, **kwargs):
+    instance.period = booking_period(instance)
+
+
+@receiver(post_save, sender=RentalInfo)
+@receiver(post_save, sender=RentByBot)
+@receiver(post_delete, sender=RentalInfo)
+@receiver(post_delete, sender=RentByBot)
+def bump_car_booking_version(sender, instance, **kwargs):
+    bump_versions(car_booking_version_name(instance.car_id))
+
+
+@receiver(post_save, sender=RentalInfo)
+@receiver(post_save, sender=RentByBot)
+def sync_booking(sender, instance, **kwargs):
+    sync_bookings([instance])
+
+
+@receiver(post_delete, sender=RentalInfo)
+@receiver(post_delete, sender=RentByBot)
+def delete_booking(sender, instance, **kwargs):
+    Booking.objects.filter(channel=BOOKING_CHANNELS[sender], source_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=RentalOrder)
+def set_booking_user(sender, instance: RentalOrder, **kwargs):
+    Booking.objects.filter(channel=Booking.Channel.WEB, source_id=instance.rental_id).update(user_id=instance.user_id)
+
+
+@receiver(post_init, sender=RentalInfo)
+@receiver(post_init, sender=RentByBot)
+def remember_booking_day(sender, instance, **kwargs):
+    instance._loaded_rental_key = (instance.__dict__.get('car_id'), instance.__dict__.get('pickup_date'))
+
+
+@receiver(post_save, sender=RentalInfo)
+@receiver(post_save, sender=RentByBot)
+@receiver(post_delete, sender=RentalInfo)
+@receiver(post_delete, sender=RentByBot)
+def mark_rollup_days(sender, instance, created=False, **kwargs):
+    # New bookings are found by touched_days; edits and deletes are not, so record their days for the rollup.
     if created:
-        send_car_to_channel(instance)
-    elif instance.telegram_message_id:
-        update_car_post(instance)
+        return
+    mark_touched_days(instance._loaded_rental_key[1], booking_day(instance))
+
+
+@receiver(post_save, sender=RentalInfo)
+@receiver(post_save, sender=RentByBot)
+def update_rental_counters(sender, instance, created: bool, **kwargs):
+    old_key = (None, None) if created else instance._loaded_rental_key
+    new_key = (instance.car_id, booking_day(instance))
+    if old_key == new_key:
+        return
+    with transaction.atomic():
+        if old_key[0]:
+            change_rental_count(*old_key, -1)
+        change_rental_count(*new_key, 1)
+    instance._loaded_rental_key = new_key
+
+
+@receiver(post_delete, sender=RentalInfo)
+@receiver(post_delete, sender=RentByBot)
+def decrease_rental_counters(sender, instance, **kwargs):
+    change_rental_count(instance.car_id, booking_day(instance), -1)
+
+
+@receiver(post_init, sender=Car)
+@receiver(post_init, sender=CarImages)
+@receiver(post_init, sender=User)
+def remember_image_names(sender, instance, **kwargs):
+    instance._loaded_image_names = {field: file_name(instance, field) for field in RENDITION_FIELDS[sender]}
+
+
+@receiver(pre_save, sender=Car)
+@receiver(pre_save, sender=CarImages)
+@receiver(pre_save, sender=User)
+def reset_stale_renditions(sender, instance, update_fields=None, **kwargs):
+    instance._rendition_jobs = []
+    for field, target in RENDITION_FIELDS[sender].items():
+        if field not in instance.__dict__ or (update_fields is not None and field not in update_fields):
+            continue
+        image = getattr(instance, field)
+        old_name = None if instance._state.adding else instance._loaded_image_names[field]
+        if image.name == old_name and image._committed:
+            continue
+        instance._rendition_jobs.append((field, old_name))
+        setattr(instance, target, [])
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_save, sender=CarImages)
+@receiver(post_save, sender=User)
+def update_image_refs(sender, instance, **kwargs):
+    for field, old_name in getattr(instance, '_rendition_jobs', ()):
+        name = getattr(instance, field).name or ''
+        instance._loaded_image_names[field] = name
+        if name != old_name:
+            change_blob_refs([old_name], -1)
+            change_blob_refs([name], 1)
+        if name:
+            queue_renditions([instance], field)
+    instance._rendition_jobs = []
+
+
+@receiver(post_delete, sender=Car)
+@receiver(post_delete, sender=CarImages)
+@receiver(post_delete, sender=User)
+def release_image_refs(sender, instance, **kwargs):
+    change_blob_refs([file_name(instance, field) for field in RENDITION_FIELDS[sender]], -1)
 
 
 @receiver(post_save, sender=Car)
 def notify_users_about_car(sender, instance: Car, created, **kwargs):
-    if created:
-        car = instance
-
-        user_ids = list(
-            RentByBot.objects.filter(car__name__icontains=car.name)
-            .values_list("tg_user_id", flat=True)
-            .distinct()
-        )
-
-        if user_ids:
-            text = (
-                f"🚘 A similar car that you ordered before is available again!\n\n"
-                f"📌 {car.name}\n"
-                f"💰 Price: {car.price}\n"
-                f"⚙️ Details: {car.description or 'No details'}"
-            )
-
-            for user_id in user_ids:
-                try:
-                    asyncio.run(bot.send_message(chat_id=user_id, text=text, reply_markup=keyboard))
-                except Exception as e:
-                    print(f"Error sending notification: {e}")
+    if not created:
+        return
+    user_ids = (
+        RentByBot.objects.filter(car__name__icontains=instance.name).order_by()
+        .values_list('tg_user_id', flat=True).distinct()
+    )
+    enqueue_customer_notifications(instance.pk, user_ids)
@@ -0,0 +1,40 @@
+from hashlib import sha256
+from os.path import splitext
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+BLOBS_DIR = 'blobs'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Names every saved file by the sha256 of its content, e.g. blobs/3f/a2/3fa2....jpg, so identical uploads
+    share one file. The name asked for by `upload_to` only contributes its extension.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def content_name(self, name, content):
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{splitext(name)[1].lower()}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+content_storage = ContentAddressedStorage()
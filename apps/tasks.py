@@ -0,0 +1,221 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.utils import timezone
+from PIL import UnidentifiedImageError
+from redis.exceptions import RedisError
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Q, IntegerField, FloatField, Exists
+from django.db.models.functions import Coalesce, Now, Cast, NullIf
+
+from apps.cache import bump_versions, model_version_name
+from apps.analytics import rollup_days, touched_days, recent_days, pop_touched_days, mark_touched_days
+from apps.bookings import BOOKING_MODELS, UNPAID_BOOKING_TIMEOUT
+from apps.models import Car, Category, Review, CarRentalStat, ImageBlob, RentByBot
+from apps.renditions import RENDITION_FIELDS, build_renditions, delete_blob
+from root.settings import redis
+
+ROLLUP_CHECKPOINT_KEY = 'analytics:rollup-checkpoint'
+BLOB_GRACE_HOURS = 24
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def reconcile_category_car_amounts():
+    actual = Coalesce(
+        Subquery(
+            Car.objects.filter(category=OuterRef('pk')).order_by()
+            .values('category').annotate(total=Count('id')).values('total')
+        ),
+        0
+    )
+    fixed = (
+        Category.objects
+        .annotate(actual=actual)
+        .exclude(car_amount=F('actual'))
+        .update(car_amount=actual, updated_at=Now())
+    )
+    if fixed:
+        bump_versions(model_version_name(Category))
+    return fixed
+
+
+@shared_task
+def reconcile_car_ratings():
+    Review.objects.exclude(rating=Cast('stars', IntegerField())).update(rating=Cast('stars', IntegerField()))
+
+    def review_aggregate(aggregate):
+        return Coalesce(
+            Subquery(
+                Review.objects.filter(car=OuterRef('pk')).order_by()
+                .values('car').annotate(value=aggregate).values('value')
+            ),
+            0
+        )
+
+    rating_sum = review_aggregate(Sum('rating'))
+    review_count = review_aggregate(Count('id'))
+    updated = Car.objects.update(
+        review_count=review_count,
+        rating_sum=rating_sum,
+        rating_avg=Coalesce(Cast(rating_sum, FloatField()) / NullIf(review_count, 0), 0.0),
+        **{
+            f'rating_{stars}': review_aggregate(Count('id', filter=Q(rating=stars)))
+            for stars in range(1, 6)
+        }
+    )
+    bump_versions(model_version_name(Car))
+    return updated
+
+
+@shared_task
+def rebuild_rental_counters():
+    totals = defaultdict(int)
+    for model in BOOKING_MODELS:
+        rows = model.objects.order_by().values_list('car_id', 'pickup_date').annotate(total=Count('id'))
+        for car_id, day, total in rows.iterator():
+            totals[car_id, day] += total
+
+    with transaction.atomic():
+        CarRentalStat.objects.all().delete()
+        CarRentalStat.objects.bulk_create(
+            [CarRentalStat(car_id=car_id, day=day, rental_count=total) for (car_id, day), total in totals.items()],
+            batch_size=1000
+        )
+        Car.objects.update(rental_count=Coalesce(
+            Subquery(
+                CarRentalStat.objects.filter(car=OuterRef('pk')).order_by()
+                .values('car').annotate(total=Sum('rental_count')).values('total')
+            ),
+            0
+        ))
+    return len(totals)
+
+
+def _rollup_since(since, days):
+    started = timezone.now()
+    marked = pop_touched_days()
+    try:
+        built = rollup_days(days | marked | touched_days(since))
+    except Exception:
+        mark_touched_days(*marked)
+        raise
+    try:
+        redis.set(ROLLUP_CHECKPOINT_KEY, started.isoformat())
+    except RedisError:
+        pass
+    return built
+
+
+@shared_task
+def build_daily_rollups():
+    return _rollup_since(timezone.now() - timedelta(days=1), recent_days())
+
+
+@shared_task
+def build_intraday_rollups():
+    try:
+        checkpoint = redis.get(ROLLUP_CHECKPOINT_KEY)
+    except RedisError:
+        checkpoint = None
+    since = datetime.fromisoformat(checkpoint) if checkpoint else timezone.now() - timedelta(days=1)
+    return _rollup_since(since, {timezone.localdate()})
+
+
+@shared_task
+def generate_renditions(model_label, pk, field, name):
+    model = django_apps.get_model(model_label)
+    target = RENDITION_FIELDS[model][field]
+    instance = model.objects.filter(pk=pk).only('pk', field).first()
+    # A newer upload replaced this file; its own task builds the renditions.
+    if not name or instance is None or getattr(instance, field).name != name:
+        return 0
+
+    # Identical uploads share one blob, so its renditions are built once and copied to every row.
+    with transaction.atomic():
+        blob, _ = ImageBlob.objects.select_for_update().get_or_create(name=name)
+        renditions = blob.renditions
+        if not renditions:
+            try:
+                renditions = build_renditions(getattr(instance, field))
+            except (OSError, UnidentifiedImageError) as e:
+                logger.warning('Cannot build renditions for %s %s (%s): %s', model_label, pk, name, e)
+                return 0
+            ImageBlob.objects.filter(pk=blob.pk).update(renditions=renditions, updated_at=Now())
+
+    if not model.objects.filter(pk=pk, **{field: name}).update(**{target: renditions, 'updated_at': Now()}):
+        return 0
+    bump_versions(model_version_name(model))
+    return len(renditions)
+
+
+def queue_renditions(instances, field):
+    """
+    Schedule generate_renditions after commit. With CELERY_TASK_ALWAYS_EAGER (the local default) the renditions
+    are built inline in the saving request; deployments turn eager mode off so the worker builds them.
+    """
+    for instance in instances:
+        name = getattr(instance, field).name
+        if name:
+            transaction.on_commit(partial(
+                generate_renditions.delay, instance._meta.label, instance.pk, field, name
+            ))
+
+
+@shared_task
+def reconcile_image_blobs():
+    counts = Counter()
+    for model, fields in RENDITION_FIELDS.items():
+        for field in fields:
+            counts.update(dict(
+                model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).order_by()
+                .values_list(field).annotate(total=Count('pk'))
+            ))
+    existing = dict(ImageBlob.objects.values_list('name', 'ref_count'))
+    changed = [ImageBlob(name=name, ref_count=count) for name, count in counts.items() if existing.get(name) != count]
+    changed += [ImageBlob(name=name, ref_count=0) for name, count in existing.items() if count and name not in counts]
+    ImageBlob.objects.bulk_create(
+        changed, update_conflicts=True, unique_fields=['name'], update_fields=['ref_count', 'updated_at'],
+        batch_size=1000
+    )
+    return len(changed)
+
+
+@shared_task
+def collect_image_blobs(grace_hours=BLOB_GRACE_HOURS):
+    candidates = ImageBlob.objects.filter(
+        ref_count__lte=0, updated_at__lt=timezone.now() - timedelta(hours=grace_hours)
+    )
+    for model, fields in RENDITION_FIELDS.items():
+        for field in fields:
+            candidates = candidates.exclude(Exists(model.objects.filter(**{field: OuterRef('name')})))
+
+    deleted = 0
+    for pk in candidates.values_list('pk', flat=True).iterator():
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update(skip_locked=True).filter(pk=pk, ref_count__lte=0).first()
+            if blob is None:
+                continue
+            blob.delete()
+            transaction.on_commit(partial(delete_blob, blob))
+        deleted += 1
+    return deleted
+
+
+@shared_task
+def expire_unpaid_bookings():
+    stale = RentByBot.objects.filter(
+        payment_status='pending', created_at__lt=timezone.now() - UNPAID_BOOKING_TIMEOUT
+    ).exclude(payment_method='cash')
+    expired = 0
+    for rent in stale.iterator():
+        # save() keeps Booking, the calendar versions and the rental counters in step.
+        rent.payment_status = 'failed'
+        rent.save(update_fields=['payment_status', 'updated_at'])
+        expired += 1
+    return expired
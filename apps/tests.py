@@ -1,3 +1,771 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import date, datetime, time
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.analytics import rental_report, rollup_days
+from apps.bookings import BookingConflict, UNPAID_BOOKING_TIMEOUT, create_booking, record_card_payment
+from apps.descriptions import render_description, description_caption
+from apps.imports import import_cars
+from apps.models import Category, Car, CarImages, Review, Region, District, BillingInfo, Location, RentalInfo, \
+    RentalOrder, RentByBot, Booking, ImageBlob, CarRentalStat, TelegramOutbox
+from apps.outbox import MAX_ATTEMPTS, claim_batch, drain_outbox, enqueue_car_posts, enqueue_customer_notifications, \
+    retry
+from apps.pagination import encode_cursor
+from apps.serializers import CarModelSerializer
+from apps.tasks import expire_unpaid_bookings, reconcile_category_car_amounts, reconcile_car_ratings, \
+    rebuild_rental_counters, collect_image_blobs, reconcile_image_blobs
+from authentication.models import User, Wishlist
+
+
+
+def create_car(category, **fields):
+    return Car.objects.create(**{
+        'name': 'Car', 'description': '<p>Fast</p>', 'category': category, 'capacity': Car.CapacityType.FOUR,
+        'steering': Car.SteeringType.MANUAL, 'gasoline': '70L', 'price': 100, 'main_image': 'main_images/car.jpg',
+        **fields,
+    })
+
+class CarQueryCountTestCase(TestCase):
+    CAR_COUNT = 5
+
+    def setUp(self):
+        # Keep the Redis response cache out of the query counts.
+        patcher = patch('apps.cache.get_versions', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        category = Category.objects.create(name='Sport')
+        district = District.objects.create(name='Yunusobod', region=Region.objects.create(name='Toshkent'))
+        location = Location.objects.create(name='Chilonzor')
+
+        for i in range(self.CAR_COUNT):
+            car = Car.objects.create(
+                name=f'Car {i}', description='<p>Fast</p>', category=category, capacity=Car.CapacityType.FOUR,
+                steering=Car.SteeringType.MANUAL, gasoline='70L', price=100 + i, main_image='main_images/car.jpg'
+            )
+            CarImages.objects.create(car=car, images='cars/1.jpg')
+            CarImages.objects.create(car=car, images='cars/2.jpg')
+            Review.objects.create(car=car, user=self.user, stars=Review.StarsNumber.FIVE, text='Great')
+            Wishlist.objects.create(car=car, user=self.user)
+            rental = RentalInfo.objects.create(
+                car=car, pickup_location=location, pickup_date=date(2026, 1, i + 1), pickup_time=time(10),
+                dropoff_location=location, dropoff_date=date(2026, 1, i + 2), dropoff_time=time(10)
+            )
+            billing = BillingInfo.objects.create(
+                user=self.user, full_name='Test User', phone='998901234567', district=district
+            )
+            RentalOrder.objects.create(user=self.user, billing=billing, rental=rental)
+
+        self.car = car
+
+    def test_car_list(self):
+        # 3 validator aggregates + cars, images
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/v1/cars')
+        self.assertEqual(response.status_code, 200)
+
+    def test_car_detail(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/v1/car-detail/{self.car.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('reviews', response.data)
+        self.assertNotIn('description', response.data)
+        self.assertEqual(response.data['description_html'], '<p>Fast</p>')
+
+    def test_car_list_not_modified(self):
+        response = self.client.get('/api/v1/cars')
+        self.assertNotIn('Last-Modified', response.headers)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/cars', HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_car_list_not_modified(self):
+        store = {}
+        with patch('apps.cache.get_versions', side_effect=lambda *names: ['1'] * len(names)), \
+                patch('apps.cache.cache_get', side_effect=store.get), \
+                patch('apps.cache.cache_set', side_effect=lambda key, value, timeout: store.update({key: value})):
+            etag = self.client.get('/api/v1/cars').headers['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/v1/cars', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_inverted_availability_range_is_rejected(self):
+        params = {'available_after': '2026-05-03T10:00:00Z', 'available_before': '2026-05-01T10:00:00Z'}
+        self.assertEqual(self.client.get('/api/v1/cars', params).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/cars/facets', params).status_code, 400)
+
+    def test_wishlist_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/wishlists')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rental_order_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/rental-orders')
+        self.assertEqual(response.status_code, 200)
+
+
+class BookingConflictTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.location = Location.objects.create(name='Chilonzor')
+        self.district = District.objects.create(name='Yunusobod', region=Region.objects.create(name='Toshkent'))
+        self.car = Car.objects.create(
+            name='Car', description='<p>Fast</p>', category=Category.objects.create(name='Sport'),
+            capacity=Car.CapacityType.FOUR, steering=Car.SteeringType.MANUAL, gasoline='70L', price=100,
+            main_image='main_images/car.jpg'
+        )
+
+    def order(self, pickup_date, dropoff_date):
+        return self.client.post('/api/v1/rental-orders', {
+            'billing': {'full_name': 'Test User', 'phone': '+998901234567', 'district': self.district.pk},
+            'rental': {
+                'car_id': self.car.pk, 'pickup_location': self.location.pk, 'pickup_date': pickup_date,
+                'pickup_time': '10:00', 'dropoff_location': self.location.pk, 'dropoff_date': dropoff_date,
+                'dropoff_time': '10:00',
+            },
+        }, format='json')
+
+    def rent_by_bot(self, **fields):
+        return create_booking(
+            RentByBot, car=self.car, name='Bot User', phone='998901234567', pickup_location=self.location,
+            pickup_date=date(2026, 3, 1), pickup_time=time(10), dropoff_location=self.location,
+            dropoff_date=date(2026, 3, 3), dropoff_time=time(10), payment_method='card', tg_user_id=1, **fields
+        )
+
+    def test_backfills_skip_legacy_conflicts(self):
+        kept = self.rent_by_bot()
+        fields = dict(
+            car=self.car, name='Bot User', phone='998901234567', pickup_location=self.location, pickup_time=time(10),
+            dropoff_location=self.location, dropoff_time=time(10), payment_method='card', tg_user_id=1,
+        )
+        # bulk_create skips the signals, like rows saved before the period column existed.
+        overlapping, inverted, free = RentByBot.objects.bulk_create([
+            RentByBot(pickup_date=date(2026, 3, 2), dropoff_date=date(2026, 3, 4), **fields),
+            RentByBot(pickup_date=date(2026, 3, 9), dropoff_date=date(2026, 3, 8), **fields),
+            RentByBot(pickup_date=date(2026, 3, 10), dropoff_date=date(2026, 3, 12), **fields),
+        ])
+        call_command('update_booking_periods', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(
+            set(RentByBot.objects.filter(period__isnull=True).values_list('pk', flat=True)), {overlapping.pk, inverted.pk}
+        )
+        call_command('rebuild_bookings', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(set(Booking.objects.values_list('source_id', flat=True)), {kept.pk, free.pk})
+
+    def test_overlapping_order_conflicts(self):
+        self.assertEqual(self.order('2026-02-01', '2026-02-03').status_code, 201)
+        response = self.order('2026-02-02', '2026-02-04')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(RentalOrder.objects.count(), 1)
+
+    def test_adjacent_order_is_allowed(self):
+        self.assertEqual(self.order('2026-02-01', '2026-02-03').status_code, 201)
+        self.assertEqual(self.order('2026-02-03', '2026-02-05').status_code, 201)
+
+    def test_bot_booking_conflicts_with_web_order(self):
+        self.rent_by_bot()
+        self.assertEqual(self.order('2026-03-02', '2026-03-04').status_code, 409)
+
+    def test_failed_payment_releases_car(self):
+        rent = self.rent_by_bot()
+        rent.payment_status = 'failed'
+        rent.save(update_fields=['payment_status', 'updated_at'])
+        self.assertEqual(self.order('2026-03-02', '2026-03-04').status_code, 201)
+        with self.assertRaises(BookingConflict):
+            self.rent_by_bot()
+
+    def test_late_payment_after_rebooking_is_flagged_for_refund(self):
+        late = self.rent_by_bot()
+        RentByBot.objects.filter(pk=late.pk).update(created_at=timezone.now() - UNPAID_BOOKING_TIMEOUT * 2)
+        expire_unpaid_bookings()
+        self.rent_by_bot()
+
+        rent = record_card_payment(late.pk, 'charge', 10000, 'UZS')
+        self.assertEqual((rent.payment_status, rent.refund_due), ('failed', True))
+        self.assertEqual(Booking.objects.get(channel=Booking.Channel.BOT, source_id=late.pk).payment_status, 'failed')
+
+    def test_late_payment_takes_back_a_free_slot(self):
+        late = self.rent_by_bot()
+        RentByBot.objects.filter(pk=late.pk).update(created_at=timezone.now() - UNPAID_BOOKING_TIMEOUT * 2)
+        expire_unpaid_bookings()
+
+        rent = record_card_payment(late.pk, 'charge', 10000, 'UZS')
+        self.assertEqual((rent.payment_status, rent.refund_due), ('paid', False))
+
+    def test_stale_card_booking_expires(self):
+        rent = self.rent_by_bot()
+        RentByBot.objects.filter(pk=rent.pk).update(created_at=timezone.now() - UNPAID_BOOKING_TIMEOUT * 2)
+        self.assertEqual(expire_unpaid_bookings(), 1)
+        self.assertEqual(Booking.objects.get(channel=Booking.Channel.BOT, source_id=rent.pk).payment_status, 'failed')
+
+
+class DescriptionTestCase(SimpleTestCase):
+    def test_void_dropped_tag_keeps_following_content(self):
+        html, text = render_description('<p>before<embed src="x.swf">after</p><p>second</p>')
+        self.assertEqual(html, '<p>beforeafter</p><p>second</p>')
+        self.assertEqual(text, 'beforeafter\nsecond')
+
+    def test_dropped_tag_content_is_removed(self):
+        html, text = render_description('<p>a<script>alert(1)</script>b</p><style>p {}</style><p>c</p>')
+        self.assertEqual(html, '<p>ab</p><p>c</p>')
+        self.assertEqual(text, 'ab\nc')
+
+    def test_unsafe_attributes_are_stripped(self):
+        html, _ = render_description('<a href="javascript:alert(1)" onclick="x">x</a><a href="https://a.uz">y</a>')
+        self.assertEqual(html, '<a>x</a><a href="https://a.uz">y</a>')
+
+    def test_unclosed_tags_are_closed(self):
+        html, _ = render_description('<ul><li><b>one</ul><p>two')
+        self.assertEqual(html, '<ul><li><b>one</b></li></ul><p>two</p>')
+
+    def test_caption_is_truncated_and_escaped(self):
+        self.assertEqual(description_caption('a < b and more words', length=12), 'a &lt; b and…')
+
+
+class CarDescriptionTestCase(TestCase):
+    def test_update_fields_save_refreshes_rendered_description(self):
+        car = Car.objects.create(
+            name='Car', description='<p>Fast</p>', category=Category.objects.create(name='Sport'),
+            capacity=Car.CapacityType.FOUR, steering=Car.SteeringType.MANUAL, gasoline='70L', price=100,
+            main_image='main_images/car.jpg'
+        )
+        car.description = '<p>Faster</p>'
+        car.save(update_fields=['description'])
+        car.refresh_from_db()
+        self.assertEqual(
+            (car.description_html, car.description_text, car.description_caption), ('<p>Faster</p>', 'Faster', 'Faster')
+        )
+
+
+class CarImportTestCase(TestCase):
+    def import_rows(self, *rows, base_dir=None):
+        return import_cars(BytesIO('\n'.join(json.dumps(row) for row in rows).encode()), 'jsonl', base_dir=base_dir)
+
+    def test_invalid_rows_are_reported(self):
+        Category.objects.create(name='Sport')
+        car = {'name': 'Car', 'description': 'Fast', 'category': 'Sport', 'capacity': '4', 'steering': 'Manual',
+               'gasoline': '70L', 'price': 100}
+        result = self.import_rows(
+            {**car, 'category': 3},
+            {**car, 'main_image': 1},
+            {**car, 'main_image': 'main.jpg', 'images': [1]},
+            {**car, 'main_image': '../main.jpg'},
+            {**car, 'main_image': '/etc/passwd'},
+        )
+        self.assertEqual(result['created'], 0)
+        self.assertEqual([error['row'] for error in result['errors']], [1, 2, 3, 4, 5])
+        self.assertEqual(result['errors'][0]['errors'], {'category': ['Must be a string.']})
+
+    def test_rejected_row_stores_no_images(self):
+        Category.objects.create(name='Sport')
+        with tempfile.TemporaryDirectory() as images_dir, tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root):
+            Image.new('RGB', (10, 10)).save(Path(images_dir) / 'car.png')
+            (Path(images_dir) / 'broken.png').write_bytes(b'not an image')
+            result = self.import_rows({
+                'name': 'Car', 'description': 'Fast', 'category': 'Sport', 'capacity': '4', 'steering': 'Manual',
+                'gasoline': '70L', 'price': 100, 'main_image': 'car.png', 'images': ['broken.png'],
+            }, base_dir=images_dir)
+            self.assertEqual(result['created'], 0)
+            self.assertEqual(list(Path(media_root).rglob('*.*')), [])
+
+
+class RenditionTestCase(TestCase):
+    def test_eager_mode_builds_renditions_on_commit(self):
+        buffer = BytesIO()
+        Image.new('RGB', (700, 70), 'red').save(buffer, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with self.captureOnCommitCallbacks(execute=True):
+                car = Car.objects.create(
+                    name='Car', description='<p>Fast</p>', category=Category.objects.create(name='Sport'),
+                    capacity=Car.CapacityType.FOUR, steering=Car.SteeringType.MANUAL, gasoline='70L', price=100,
+                    main_image=SimpleUploadedFile('car.png', buffer.getvalue()),
+                )
+        car.refresh_from_db()
+        self.assertEqual(
+            sorted((rendition['width'], rendition['format']) for rendition in car.main_image_renditions),
+            [(320, 'jpeg'), (320, 'webp'), (640, 'jpeg'), (640, 'webp')],
+        )
+        self.assertEqual(ImageBlob.objects.get(name=car.main_image.name).ref_count, 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('apps.cache.get_versions', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='user@example.com', password='pass1234'))
+
+        category = Category.objects.create(name='Sport')
+        for i, (name, price, rating) in enumerate([
+            ('Fast one', 300, 4.5), ('Fast fast two', 100, 4.5), ('Slow three', 200, 3.0),
+            ('Fast fast fast four', 100, 5.0), ('Slow five', 300, 0.0),
+        ]):
+            car = Car.objects.create(
+                name=name, description='<p>Car</p>', category=category, capacity=Car.CapacityType.FOUR,
+                steering=Car.SteeringType.MANUAL, gasoline='70L', price=price, main_image=f'main_images/{i}.jpg'
+            )
+            Car.objects.filter(pk=car.pk).update(rating_avg=rating)
+
+    def walk(self, **params):
+        names, url = [], '/api/v1/cars'
+        params = {'page_size': 2, **params}
+        while url:
+            data = self.client.get(url, params).data
+            names += [car['name'] for car in data['results']]
+            url, params = data['next'], None
+        return names
+
+    def test_pages_follow_each_ordering(self):
+        for ordering, key in [
+            ('-created_at', lambda car: (-car.created_at.timestamp(), -car.pk)),
+            ('price', lambda car: (car.price, car.pk)),
+            ('-price', lambda car: (-car.price, -car.pk)),
+            ('-rating', lambda car: (-car.rating_avg, -car.pk)),
+        ]:
+            with self.subTest(ordering=ordering):
+                expected = [car.name for car in sorted(Car.objects.all(), key=key)]
+                self.assertEqual(self.walk(ordering=ordering), expected)
+
+    def test_search_pages_follow_rank(self):
+        ranked = self.walk(search='fast', page_size=100)
+        self.assertEqual(len(ranked), 3)
+        self.assertEqual(self.walk(search='fast'), ranked)
+        self.assertEqual(self.walk(search='fast', ordering='rank'), ranked)
+
+    def test_crafted_cursor_is_rejected(self):
+        for ordering, values in [
+            ('-created_at', ['yesterday', 1]),
+            ('price', [100, 'abc']),
+            ('-rating', [[1], 1]),
+            ('price', [None, 1]),
+            ('price', [100]),
+        ]:
+            with self.subTest(ordering=ordering, values=values):
+                response = self.client.get('/api/v1/cars', {'ordering': ordering, 'cursor': encode_cursor(values)})
+                self.assertEqual(response.status_code, 404)
+
+
+class GalleryTestCase(TestCase):
+    @staticmethod
+    def upload(color):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(f'{color}.png', buffer.getvalue())
+
+    def test_gallery_diff_keeps_moves_reuses_and_deletes(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            car = Car.objects.create(
+                name='Car', description='<p>Fast</p>', category=Category.objects.create(name='Sport'),
+                capacity=Car.CapacityType.FOUR, steering=Car.SteeringType.MANUAL, gasoline='70L', price=100,
+                main_image='main_images/car.jpg'
+            )
+            CarModelSerializer.save_gallery(car, [self.upload('red'), self.upload('green'), self.upload('blue')])
+            red, green, blue = car.carimages_set.all()
+
+            # blue moves first, a re-upload of red reuses its row, green is dropped and white is new.
+            CarModelSerializer.save_gallery(
+                car, [blue.pk, self.upload('red'), self.upload('white')], car.carimages_set.all()
+            )
+            images = list(car.carimages_set.all())
+            self.assertEqual([image.pk for image in images[:2]], [blue.pk, red.pk])
+            self.assertEqual([image.position for image in images], [0, 1, 2])
+            self.assertFalse(CarImages.objects.filter(pk=green.pk).exists())
+            self.assertEqual(ImageBlob.objects.get(name=green.images.name).ref_count, 0)
+            self.assertEqual(ImageBlob.objects.get(name=red.images.name).ref_count, 1)
+            self.assertEqual(ImageBlob.objects.get(name=images[2].images.name).ref_count, 1)
+
+
+class CategoryCarAmountTestCase(TestCase):
+    def setUp(self):
+        self.sport = Category.objects.create(name='Sport')
+        self.family = Category.objects.create(name='Family')
+
+    def amounts(self):
+        return dict(Category.objects.values_list('name', 'car_amount'))
+
+    def test_car_amount_follows_create_move_and_delete(self):
+        car, other = create_car(self.sport), create_car(self.sport)
+        self.assertEqual(self.amounts(), {'Sport': 2, 'Family': 0})
+
+        car.category = self.family
+        car.save()
+        car.save()
+        self.assertEqual(self.amounts(), {'Sport': 1, 'Family': 1})
+
+        other.delete()
+        car.delete()
+        self.assertEqual(self.amounts(), {'Sport': 0, 'Family': 0})
+        self.assertEqual(reconcile_category_car_amounts(), 0)
+
+
+class CarRatingTestCase(TestCase):
+    RATING_FIELDS = ('review_count', 'rating_sum', 'rating_avg', 'rating_1', 'rating_3', 'rating_5')
+
+    def setUp(self):
+        category = Category.objects.create(name='Sport')
+        self.car, self.other = create_car(category), create_car(category)
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+
+    def ratings(self, car):
+        return Car.objects.filter(pk=car.pk).values(*self.RATING_FIELDS).get()
+
+    def test_ratings_follow_create_update_move_and_delete(self):
+        five = Review.objects.create(car=self.car, user=self.user, stars=Review.StarsNumber.FIVE, text='Great')
+        one = Review.objects.create(car=self.car, user=self.user, stars=Review.StarsNumber.ONE, text='Bad')
+        self.assertEqual(self.ratings(self.car), {
+            'review_count': 2, 'rating_sum': 6, 'rating_avg': 3.0, 'rating_1': 1, 'rating_3': 0, 'rating_5': 1,
+        })
+
+        one.stars = Review.StarsNumber.THREE
+        one.save()
+        self.assertEqual(self.ratings(self.car), {
+            'review_count': 2, 'rating_sum': 8, 'rating_avg': 4.0, 'rating_1': 0, 'rating_3': 1, 'rating_5': 1,
+        })
+
+        five.car = self.other
+        five.save()
+        self.assertEqual(self.ratings(self.car), {
+            'review_count': 1, 'rating_sum': 3, 'rating_avg': 3.0, 'rating_1': 0, 'rating_3': 1, 'rating_5': 0,
+        })
+        self.assertEqual(self.ratings(self.other), {
+            'review_count': 1, 'rating_sum': 5, 'rating_avg': 5.0, 'rating_1': 0, 'rating_3': 0, 'rating_5': 1,
+        })
+
+        one.delete()
+        self.assertEqual(self.ratings(self.car), {
+            'review_count': 0, 'rating_sum': 0, 'rating_avg': 0.0, 'rating_1': 0, 'rating_3': 0, 'rating_5': 0,
+        })
+
+        incremental = [self.ratings(self.car), self.ratings(self.other)]
+        reconcile_car_ratings()
+        self.assertEqual([self.ratings(self.car), self.ratings(self.other)], incremental)
+
+
+class RentalCounterTestCase(TestCase):
+    def setUp(self):
+        self.car = create_car(Category.objects.create(name='Sport'))
+        self.location = Location.objects.create(name='Chilonzor')
+
+    def rent(self, day, pickup, dropoff):
+        return create_booking(
+            RentByBot, car=self.car, name='Bot User', phone='998901234567', pickup_location=self.location,
+            pickup_date=day, pickup_time=pickup, dropoff_location=self.location, dropoff_date=day,
+            dropoff_time=dropoff, tg_user_id=1,
+        )
+
+    def counters(self):
+        stats = dict(CarRentalStat.objects.filter(car=self.car, rental_count__gt=0).values_list('day', 'rental_count'))
+        return Car.objects.get(pk=self.car.pk).rental_count, stats
+
+    def test_counters_follow_create_move_and_delete(self):
+        first = self.rent(date(2026, 3, 1), time(10), time(12))
+        second = self.rent(date(2026, 3, 1), time(14), time(16))
+        self.assertEqual(self.counters(), (2, {date(2026, 3, 1): 2}))
+
+        second.pickup_date = second.dropoff_date = date(2026, 3, 5)
+        second.save()
+        self.assertEqual(self.counters(), (2, {date(2026, 3, 1): 1, date(2026, 3, 5): 1}))
+
+        first.delete()
+        self.assertEqual(self.counters(), (1, {date(2026, 3, 5): 1}))
+
+        incremental = self.counters()
+        rebuild_rental_counters()
+        self.assertEqual(self.counters(), incremental)
+
+
+class TelegramOutboxTestCase(TestCase):
+    def setUp(self):
+        self.car = create_car(Category.objects.create(name='Sport'))
+
+    def rows(self):
+        return list(TelegramOutbox.objects.order_by('id').values_list('chat_id', 'status', 'attempts'))
+
+    def test_pending_posts_coalesce(self):
+        self.car.save()
+        enqueue_car_posts([self.car.pk])
+        enqueue_customer_notifications(self.car.pk, [7, 7, 8])
+        self.assertEqual(self.rows(), [(None, 'pending', 0), (7, 'pending', 0), (8, 'pending', 0)])
+
+    def test_edit_during_processing_queues_a_new_post(self):
+        [(car, rows)] = claim_batch()
+        self.assertEqual(car, self.car)
+        self.car.save()
+        self.assertEqual(self.rows(), [(None, 'processing', 0), (None, 'pending', 0)])
+
+        # The newer pending row carries the latest state, the failed one is dropped instead of retried.
+        retry(rows, 'timeout')
+        self.assertEqual(self.rows(), [(None, 'pending', 0)])
+
+    def test_retry_backs_off_and_gives_up(self):
+        [(_, rows)] = claim_batch()
+        retry(rows, 'timeout')
+        self.assertEqual(self.rows(), [(None, 'pending', 1)])
+        self.assertEqual(claim_batch(), [])
+
+        TelegramOutbox.objects.update(attempts=MAX_ATTEMPTS - 1, available_at=timezone.now())
+        [(_, rows)] = claim_batch()
+        retry(rows, 'timeout')
+        self.assertEqual(self.rows(), [(None, 'failed', MAX_ATTEMPTS)])
+
+    def test_drain_completes_sent_posts_and_retries_failures(self):
+        enqueue_customer_notifications(self.car.pk, [7])
+        with patch('apps.outbox.asyncio.sleep', new=AsyncMock()), \
+                patch('apps.outbox.post_car', new=AsyncMock()) as post_car, \
+                patch('apps.outbox.notify_customer', new=AsyncMock(side_effect=RuntimeError('boom'))):
+            self.assertEqual(async_to_sync(drain_outbox)(bot=None), 2)
+        post_car.assert_awaited_once()
+        self.assertEqual(self.rows(), [(7, 'pending', 1)])
+        self.assertEqual(TelegramOutbox.objects.get().last_error, 'boom')
+
+
+class CarSearchTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('apps.cache.get_versions', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='user@example.com', password='pass1234'))
+
+        self.electric = Category.objects.create(name='Electric')
+        create_car(self.electric, name='Tesla Model', description='<strong>Quick</strong>')
+        compact = Category.objects.create(name='Compact')
+        create_car(compact, name='Nissan Leaf', description='<p>Cheaper than a Tesla</p>')
+        create_car(self.electric, name='Audi', description='<p>Quiet</p>')
+
+    def search(self, terms):
+        return [car['name'] for car in self.client.get('/api/v1/cars', {'search': terms}).data['results']]
+
+    def test_name_outranks_description(self):
+        self.assertEqual(self.search('tesla'), ['Tesla Model', 'Nissan Leaf'])
+
+    def test_matches_word_prefixes_of_every_term(self):
+        self.assertEqual(self.search('tes mod'), ['Tesla Model'])
+        self.assertEqual(sorted(self.search('qui')), ['Audi', 'Tesla Model'])
+
+    def test_markup_is_not_searchable(self):
+        self.assertEqual(self.search('strong'), [])
+
+    def test_terms_without_words_do_not_filter(self):
+        self.assertEqual(len(self.search('&|!')), 3)
+
+    def test_category_rename_updates_vectors(self):
+        self.assertEqual(sorted(self.search('electric')), ['Audi', 'Tesla Model'])
+        self.electric.name = 'Hybrid'
+        self.electric.save()
+        self.assertEqual(self.search('electric'), [])
+        self.assertEqual(sorted(self.search('hybrid')), ['Audi', 'Tesla Model'])
+
+
+class CarFacetsTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('apps.cache.get_versions', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='user@example.com', password='pass1234'))
+
+        self.sport = Category.objects.create(name='Sport')
+        self.suv = Category.objects.create(name='SUV')
+        create_car(self.sport, price=50_000)
+        create_car(self.sport, price=150_000, capacity=Car.CapacityType.TWO, steering=Car.SteeringType.POWER)
+        create_car(self.suv, price=2_000_000)
+
+    def test_counts_every_facet_in_one_pass(self):
+        self.assertEqual(self.client.get('/api/v1/cars/facets').data, {
+            'total': 3,
+            'category': [{'value': self.sport.pk, 'count': 2}, {'value': self.suv.pk, 'count': 1}],
+            'capacity': [{'value': '2', 'count': 1}, {'value': '4', 'count': 2}],
+            'steering': [{'value': 'Manual', 'count': 2}, {'value': 'Power', 'count': 1}],
+            'price_band': [
+                {'min': 0, 'max': 100_000, 'count': 1},
+                {'min': 100_000, 'max': 300_000, 'count': 1},
+                {'min': 1_000_000, 'max': None, 'count': 1},
+            ],
+        })
+
+    def test_counts_follow_the_list_filters(self):
+        facets = self.client.get('/api/v1/cars/facets', {'price_max': 1_000_000, 'cursor': 'ignored'}).data
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual(facets['category'], [{'value': self.sport.pk, 'count': 2}])
+
+
+class CarCalendarTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('apps.cache.get_versions', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='user@example.com', password='pass1234'))
+
+        category = Category.objects.create(name='Sport')
+        self.car, self.idle_car = create_car(category), create_car(category)
+        self.location = Location.objects.create(name='Chilonzor')
+
+    def rent(self, pickup, dropoff):
+        return create_booking(
+            RentByBot, car=self.car, name='Bot User', phone='998901234567', tg_user_id=1,
+            pickup_location=self.location, pickup_date=pickup.date(), pickup_time=pickup.time(),
+            dropoff_location=self.location, dropoff_date=dropoff.date(), dropoff_time=dropoff.time(),
+        )
+
+    def calendar(self, **params):
+        return self.client.get('/api/v1/cars/calendar', params)
+
+    def test_marks_booked_days_of_the_month(self):
+        # Spills over from January, ends at midnight, and a failed payment that no longer holds the car.
+        self.rent(datetime(2026, 1, 30, 10), datetime(2026, 2, 2, 10))
+        self.rent(datetime(2026, 2, 14, 22), datetime(2026, 2, 15, 0))
+        failed = self.rent(datetime(2026, 2, 20, 10), datetime(2026, 2, 21, 10))
+        failed.payment_status = 'failed'
+        failed.save()
+
+        response = self.calendar(cars=f'{self.idle_car.pk},{self.car.pk}', month='2026-02')
+        booked = ['0'] * 28
+        booked[0] = booked[1] = booked[13] = '1'
+        self.assertEqual(response.json(), {
+            'month': '2026-02',
+            'cars': {str(self.car.pk): ''.join(booked), str(self.idle_car.pk): '0' * 28},
+        })
+
+    def test_rejects_invalid_params(self):
+        for params in [
+            {'month': '2026-02'},
+            {'cars': 'a,b', 'month': '2026-02'},
+            {'cars': str(self.car.pk), 'month': '2026-13'},
+            {'cars': ','.join(map(str, range(1, 102))), 'month': '2026-02'},
+        ]:
+            with self.subTest(**params):
+                self.assertEqual(self.calendar(**params).status_code, 400)
+
+
+class RentalRollupTestCase(TestCase):
+    def setUp(self):
+        self.car = create_car(Category.objects.create(name='Sport'))
+        self.location = Location.objects.create(name='Chilonzor')
+
+    def book(self, model, day, pickup, **fields):
+        return create_booking(
+            model, car=self.car, pickup_location=self.location, pickup_date=day, pickup_time=pickup,
+            dropoff_location=self.location, dropoff_date=day, dropoff_time=time(pickup.hour + 1), **fields
+        )
+
+    def rent_by_bot(self, day, pickup, **fields):
+        return self.book(RentByBot, day, pickup, name='Bot User', phone='998901234567', tg_user_id=1, **fields)
+
+    def report(self):
+        results, totals = rental_report(date(2026, 3, 1), date(2026, 3, 31), 'channel')
+        return [(row['channel'], row['rentals'], row['paid_rentals'], row['revenue']) for row in results], totals
+
+    def test_rollup_rebuilds_days_by_channel(self):
+        day = date(2026, 3, 1)
+        self.book(RentalInfo, day, time(8))
+        paid = self.rent_by_bot(day, time(10), payment_status='paid', paid_amount=500)
+        self.rent_by_bot(day, time(12))
+
+        rollup_days([day])
+        self.assertEqual(self.report(), (
+            [('bot', 2, 1, 500), ('web', 1, 0, 0)], {'rentals': 3, 'paid_rentals': 1, 'revenue': 500}
+        ))
+
+        paid.delete()
+        rollup_days([day])
+        self.assertEqual(self.report()[0], [('bot', 1, 0, 0), ('web', 1, 0, 0)])
+
+    def test_moved_booking_marks_both_days(self):
+        rent = self.rent_by_bot(date(2026, 3, 1), time(10))
+        rent.pickup_date = rent.dropoff_date = date(2026, 3, 5)
+        with patch('apps.analytics._mark_touched_days') as mark, self.captureOnCommitCallbacks(execute=True):
+            rent.save()
+        mark.assert_called_once_with([date(2026, 3, 1), date(2026, 3, 5)])
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_superuser(email='admin@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+
+        category = Category.objects.create(name='Sport')
+        for day, (name, text) in enumerate([('Tesla', 'Quiet, "fast"'), ('Audi', 'Zo‘r')], start=1):
+            review = Review.objects.create(car=create_car(category, name=name), user=self.user, stars='5', text=text)
+            Review.objects.filter(pk=review.pk).update(created_at=timezone.make_aware(datetime(2026, 3, day, 12)))
+
+    def export(self, dataset, **params):
+        response = self.client.get(f'/api/v1/exports/{dataset}', params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_streams_csv(self):
+        response, body = self.export('reviews')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="reviews.csv"')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'id,created_at,car_id,car_name,user_email,stars,text,is_edited')
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Tesla,admin@example.com,5,"Quiet, ""fast""",False', lines[1])
+
+    def test_streams_ndjson_within_dates(self):
+        response, body = self.export('reviews', output='ndjson', date_from='2026-03-02', date_to='2026-03-02')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        [row] = map(json.loads, body.splitlines())
+        self.assertEqual((row['car_name'], row['text'], row['is_edited']), ('Audi', 'Zo‘r', False))
+
+    def test_rejects_unknown_exports(self):
+        self.assertEqual(self.client.get('/api/v1/exports/payments').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/exports/reviews', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/exports/reviews', {'date_from': '03/01/2026'}).status_code, 400)
+
+
+class ImageBlobCollectionTestCase(TestCase):
+    @staticmethod
+    def upload():
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile('red.png', buffer.getvalue())
+
+    def test_shared_blob_is_collected_after_its_last_reference(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            car = create_car(Category.objects.create(name='Sport'))
+            first = CarImages.objects.create(car=car, images=self.upload())
+            second = CarImages.objects.create(car=car, images=self.upload())
+            self.assertEqual(first.images.name, second.images.name)
+            blobs = ImageBlob.objects.filter(name=first.images.name)
+            path = Path(media_root, first.images.name)
+            self.assertEqual(blobs.get().ref_count, 2)
+
+            first.delete()
+            self.assertEqual(blobs.get().ref_count, 1)
+            self.assertEqual(collect_image_blobs(grace_hours=0), 0)
+
+            # A drifted counter is caught by the reference check and repaired by the reconcile.
+            blobs.update(ref_count=0)
+            self.assertEqual(collect_image_blobs(grace_hours=0), 0)
+            self.assertEqual(reconcile_image_blobs(), 1)
+            self.assertEqual(blobs.get().ref_count, 1)
+
+            second.delete()
+            self.assertEqual(collect_image_blobs(), 0)
+            self.assertTrue(path.exists())
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(collect_image_blobs(grace_hours=0), 1)
+            self.assertFalse(blobs.exists())
+            self.assertFalse(path.exists())
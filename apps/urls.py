@@ -5,7 +5,9 @@ from apps.views import CarCreateAPIView, CategoryDeleteAPIView, CategoryCreateAP
     ReviewCreateAPIView, ReviewUpdateAPIView, ReviewDeleteAPIView, ReviewListAPIView, CarImagesCreateAPIView, \
     CarImagesUpdateAPIView, CarImagesDeleteAPIView, RentalOrderListCreateView, Top5CarsListAPIView, \
     RecentTransactionsAPIView, RegionCreateAPIView, RegionDeleteAPIView, RegionUpdateAPIView, RegionListAPIView, \
-    DistrictCreateAPIView, DistrictDeleteAPIView, DistrictUpdateAPIView, DistrictListAPIView
+    DistrictCreateAPIView, DistrictDeleteAPIView, DistrictUpdateAPIView, DistrictListAPIView, CarFacetsAPIView, \
+    CarCalendarAPIView, RentalAnalyticsAPIView, ExportAPIView, \
+    DemandMatrixAPIView, CarReviewListAPIView, CarImportAPIView
 
 ################################### CATEGORY ###################################
 urlpatterns = [
@@ -18,10 +20,13 @@ urlpatterns = [
 ################################### CAR ###################################
 urlpatterns += [
     path('car-create', CarCreateAPIView.as_view()),
+    path('cars/import', CarImportAPIView.as_view()),
     path('car-delete/<int:pk>', CarDeleteAPIView.as_view()),
     path('car-detail/<int:pk>', CarDetailAPIView.as_view()),
     path('car-update/<int:pk>', CarUpdateAPIView.as_view()),
     path('cars', CarListAPIView.as_view()),
+    path('cars/facets', CarFacetsAPIView.as_view()),
+    path('cars/calendar', CarCalendarAPIView.as_view()),
 ]
 
 ################################### STATISTICS ###################################
@@ -32,10 +37,22 @@ urlpatterns += [
 
 ]
 
+################################### ANALYTICS ###################################
+urlpatterns += [
+    path('analytics/rentals', RentalAnalyticsAPIView.as_view()),
+    path('analytics/demand-matrix', DemandMatrixAPIView.as_view()),
+]
+
+################################### EXPORT ###################################
+urlpatterns += [
+    path('exports/<str:dataset>', ExportAPIView.as_view()),
+]
+
 ################################### REVIEW ###################################
 urlpatterns += [
     path('review-create', ReviewCreateAPIView.as_view()),
     path('reviews', ReviewListAPIView.as_view()),
+    path('cars/<int:pk>/reviews', CarReviewListAPIView.as_view()),
     path('review-update/<int:pk>', ReviewUpdateAPIView.as_view()),
     path('review-delete/<int:pk>', ReviewDeleteAPIView.as_view()),
 ]
@@ -1,21 +1,74 @@
-from itertools import chain
+from datetime import date, timedelta
 
-from django.db.models.aggregates import Count
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models.aggregates import Count, Max, Sum
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema
-from rest_framework.filters import SearchFilter
-from rest_framework.generics import CreateAPIView, ListAPIView, DestroyAPIView, UpdateAPIView, RetrieveAPIView
+from rest_framework.generics import CreateAPIView, ListAPIView, DestroyAPIView, UpdateAPIView, RetrieveAPIView, \
+    GenericAPIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.views import APIView
 
+from apps.cache import CachedResponseMixin, ConditionalGetMixin, model_version_name, versioned_cache
+from apps.analytics import GROUPINGS, rental_report, DEMAND_BUCKETS, demand_matrix
+from apps.bookings import occupancy_bitmaps, car_booking_version_name
+from apps.exports import EXPORTS, FORMATS, export_rows
+from apps.facets import car_facet_counts
 from apps.filter import CarFilter
-from apps.models import Car, Category, Review, CarImages, RentalOrder, Region, District
+from apps.imports import IMPORT_FORMATS, import_cars
+from apps.models import Car, Category, Review, CarImages, RentalOrder, Region, District, Location
+from apps.pagination import KeysetPagination, RecentTransactionPagination
+from apps.search import CarSearchFilter
 from apps.serializers import CarModelSerializer, CategoryModelSerializer, ReviewModelSerializer, \
     ReviewUpdateModelSerializer, CarImagesModelSerializer, RentalOrderSerializer, RegionModelSerializer, \
     DistrictModelSerializer, RecentTransactionSerializer
-from .models import RentalInfo, RentByBot
+from .models import RentalInfo, RentByBot, CarRentalStat, Booking
+
+CAR_CACHE_MODELS = (Car, Category, CarImages, Review)
+BOOKING_CACHE_MODELS = (RentalInfo, RentByBot)
+AVAILABILITY_PARAMS = ('available_after', 'available_before')
+
+
+def uses_availability(request):
+    return any(param in request.query_params for param in AVAILABILITY_PARAMS)
+
+
+def parse_date_range(request, default_days):
+    """?date_from=&date_to= as dates, ending today and spanning `default_days` days when omitted."""
+    try:
+        date_to = request.query_params.get('date_to')
+        date_to = date.fromisoformat(date_to) if date_to else timezone.localdate()
+        date_from = request.query_params.get('date_from')
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=default_days - 1)
+    except ValueError:
+        raise ValidationError('Dates must be in YYYY-MM-DD format.')
+    if date_from > date_to:
+        raise ValidationError('date_from must not be after date_to.')
+    return date_from, date_to
+
+
+def collection_validators(*querysets):
+    # No Last-Modified: deleting the newest row moves max(updated_at) back, If-Modified-Since would then answer 304
+    # for a changed list. The ETag also covers the row counts.
+    parts = [queryset.order_by().aggregate(updated=Max('updated_at'), count=Count('id')) for queryset in querysets]
+    version = ':'.join(f"{part['count']}.{part['updated'].timestamp() if part['updated'] else 0}" for part in parts)
+    return version, None
+
+
+def car_validators(cars):
+    car_ids = cars.order_by().values('id')
+    return collection_validators(
+        cars,
+        Review.objects.filter(car__in=car_ids),
+        CarImages.objects.filter(car__in=car_ids),
+    )
 
 
 ########################################## CATEGORY ##############################################
@@ -27,9 +80,13 @@ class CategoryCreateAPIView(CreateAPIView):
 
 
 @extend_schema(tags=['category'])
-class CategoryListAPIView(ListAPIView):
+class CategoryListAPIView(ConditionalGetMixin, CachedResponseMixin, ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryModelSerializer
+    cache_models = (Category,)
+
+    def get_validators(self, request, *args, **kwargs):
+        return collection_validators(self.get_queryset())
 
 
 @extend_schema(tags=['category'])
@@ -57,12 +114,99 @@ class CarCreateAPIView(CreateAPIView):
 
 
 @extend_schema(tags=['car'])
-class CarListAPIView(ListAPIView):
-    queryset = Car.objects.all()
+class CarImportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['A CSV or JSONL file is required.']})
+        file_format = upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError({'file': [f'File type must be one of: {", ".join(IMPORT_FORMATS)}.']})
+        try:
+            report = import_cars(upload.file, file_format, archive=request.FILES.get('archive'))
+        except DjangoValidationError as e:
+            raise ValidationError({'archive': e.messages})
+        return Response(report, status=HTTP_201_CREATED if report['created'] else HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(tags=['car'])
+class CarListAPIView(ConditionalGetMixin, CachedResponseMixin, ListAPIView):
+    queryset = Car.objects.prefetch_related(*CarModelSerializer.get_prefetches())
     serializer_class = CarModelSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    cache_models = CAR_CACHE_MODELS
+    filter_backends = [DjangoFilterBackend, CarSearchFilter]
+    filterset_class = CarFilter
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'rank': ('-rank', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        '-rating': ('-rating_avg', '-id'),
+    }
+
+    def get_cache_models(self, request):
+        if uses_availability(request):
+            return self.cache_models + BOOKING_CACHE_MODELS
+        return self.cache_models
+
+    def get_validators(self, request, *args, **kwargs):
+        # Bookings carry no updated_at, so availability searches are not validated.
+        if uses_availability(request):
+            return None
+        return car_validators(self.filter_queryset(Car.objects.all()))
+
+
+@extend_schema(tags=['car'])
+class CarFacetsAPIView(GenericAPIView):
+    queryset = Car.objects.all()
+    filter_backends = [DjangoFilterBackend, CarSearchFilter]
     filterset_class = CarFilter
-    search_fields = ['name']
+    cache_models = (Car, Category)
+    cache_timeout = 60 * 60
+    ignored_params = ('cursor', 'page_size', 'ordering')
+
+    def get(self, request):
+        cache_models = self.cache_models + BOOKING_CACHE_MODELS if uses_availability(request) else self.cache_models
+        params = sorted(
+            (key, value) for key, values in request.query_params.lists() if key not in self.ignored_params
+            for value in values
+        )
+        facets = versioned_cache(
+            'car-facets', map(model_version_name, cache_models), params,
+            lambda: car_facet_counts(self.filter_queryset(self.get_queryset())), self.cache_timeout,
+        )
+        return Response(facets)
+
+
+@extend_schema(tags=['car'])
+class CarCalendarAPIView(APIView):
+    max_cars = 100
+    cache_timeout = 24 * 60 * 60
+
+    def parse_params(self, request):
+        try:
+            year, month = map(int, request.query_params['month'].split('-'))
+            car_ids = sorted({int(pk) for pk in request.query_params['cars'].split(',')})
+        except (KeyError, ValueError):
+            raise ValidationError('Use ?cars=1,2,3&month=YYYY-MM')
+        if not 1 <= month <= 12 or not 1 <= year <= 9999:
+            raise ValidationError('Invalid month.')
+        if not car_ids or len(car_ids) > self.max_cars:
+            raise ValidationError(f'Between 1 and {self.max_cars} cars are allowed.')
+        return car_ids, year, month
+
+    def get(self, request):
+        car_ids, year, month = self.parse_params(request)
+        data = versioned_cache(
+            'car-calendar', map(car_booking_version_name, car_ids), [car_ids, year, month],
+            lambda: {'month': f'{year}-{month:02}', 'cars': occupancy_bitmaps(car_ids, year, month)},
+            self.cache_timeout,
+        )
+        return Response(data)
 
 
 @extend_schema(tags=['car'])
@@ -74,11 +218,15 @@ class CarDeleteAPIView(DestroyAPIView):
 
 
 @extend_schema(tags=['car'])
-class CarDetailAPIView(RetrieveAPIView):
-    queryset = Car.objects.all()
+class CarDetailAPIView(ConditionalGetMixin, CachedResponseMixin, RetrieveAPIView):
+    queryset = Car.objects.prefetch_related(*CarModelSerializer.get_prefetches())
     serializer_class = CarModelSerializer
+    cache_models = CAR_CACHE_MODELS
     lookup_field = 'pk'
 
+    def get_validators(self, request, *args, **kwargs):
+        return car_validators(Car.objects.filter(pk=kwargs['pk']))
+
 
 @extend_schema(tags=['car'])
 class CarUpdateAPIView(UpdateAPIView):
@@ -91,52 +239,125 @@ class CarUpdateAPIView(UpdateAPIView):
 ########################################## STATISTICS ##############################################
 @extend_schema(tags=['top-5-cars'])
 class Top5CarsListAPIView(APIView):
-    def get(self, request):
-        web_orders = (
-            RentalInfo.objects
-            .values('car__id', 'car__name', 'car__category__name')
-            .annotate(rental_count=Count('id'))
-        )
+    default_limit = 5
+    max_limit = 50
 
-        bot_orders = (
-            RentByBot.objects
-            .values('car__id', 'car__name', 'car__category__name')
-            .annotate(rental_count=Count('id'))
-        )
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+            days = request.query_params.get('days')
+            days = int(days) if days else None
+        except ValueError:
+            raise ValidationError('limit and days must be integers.')
+        limit = max(1, min(limit, self.max_limit))
+
+        if days is None:
+            rows = (
+                Car.objects
+                .filter(rental_count__gt=0)
+                .order_by('-rental_count', '-id')
+                .values_list('id', 'name', 'category__name', 'rental_count')[:limit]
+            )
+        else:
+            rows = (
+                CarRentalStat.objects
+                .filter(day__gte=timezone.localdate() - timedelta(days=days))
+                .values_list('car_id', 'car__name', 'car__category__name')
+                .annotate(total=Sum('rental_count'))
+                .order_by('-total', '-car_id')[:limit]
+            )
+
+        top_cars = [
+            {
+                'car__id': car_id,
+                'car__name': name,
+                'car__category__name': category_name,
+                'rental_count': rental_count,
+            }
+            for car_id, name, category_name, rental_count in rows
+        ]
+        return Response(top_cars)
 
-        combined = {}
-        for order in list(web_orders) + list(bot_orders):
-            key = order['car__id']
-            if key not in combined:
-                combined[key] = {
-                    'car__id': order['car__id'],
-                    'car__name': order['car__name'],
-                    'car__category__name': order['car__category__name'],
-                    'rental_count': 0
-                }
-            combined[key]['rental_count'] += order['rental_count']
 
-        top_cars = sorted(combined.values(), key=lambda x: x['rental_count'], reverse=True)[:5]
+@extend_schema(tags=['recent-transactions'])
+class RecentTransactionsAPIView(ListAPIView):
+    serializer_class = RecentTransactionSerializer
+    pagination_class = RecentTransactionPagination
+    queryset = Booking.objects.select_related('car__category', 'pickup_location', 'dropoff_location')
 
-        return Response(top_cars)
 
+########################################## ANALYTICS ##############################################
+@extend_schema(tags=['analytics'])
+class RentalAnalyticsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    default_days = 30
 
-@extend_schema(tags=['recent-transactions'])
-class RecentTransactionsAPIView(APIView):
     def get(self, request):
-        web_transactions = RentalInfo.objects.all()
-        bot_transactions = RentByBot.objects.all()
+        date_from, date_to = parse_date_range(request, self.default_days)
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in GROUPINGS:
+            raise ValidationError(f'group_by must be one of: {", ".join(GROUPINGS)}.')
+
+        results, totals = rental_report(date_from, date_to, group_by)
+        return Response({
+            'date_from': date_from,
+            'date_to': date_to,
+            'group_by': group_by,
+            'totals': totals,
+            'results': results,
+        })
+
+
+@extend_schema(tags=['analytics'])
+class DemandMatrixAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    cache_models = (RentalInfo, RentByBot, Location)
+    cache_timeout = 60 * 60
+    default_days = 30
 
-        combined = sorted(
-            chain(web_transactions, bot_transactions),
-            key=lambda x: (x.pickup_date, x.pickup_time),
-            reverse=True
+    def get(self, request):
+        date_from, date_to = parse_date_range(request, self.default_days)
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in DEMAND_BUCKETS:
+            raise ValidationError(f'bucket must be one of: {", ".join(DEMAND_BUCKETS)}.')
+
+        data = versioned_cache(
+            'demand-matrix', map(model_version_name, self.cache_models), [date_from, date_to, bucket],
+            lambda: {
+                'date_from': date_from,
+                'date_to': date_to,
+                'bucket': bucket,
+                **demand_matrix(date_from, date_to, bucket),
+            },
+            self.cache_timeout,
         )
+        return Response(data)
 
-        recent = combined[:5]
 
-        serializer = RecentTransactionSerializer(recent, many=True)
-        return Response(serializer.data)
+########################################## EXPORT ##############################################
+@extend_schema(tags=['export'])
+class ExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset):
+        if dataset not in EXPORTS:
+            raise NotFound(f'Unknown export, use one of: {", ".join(EXPORTS)}.')
+        output = request.query_params.get('output', 'csv')
+        if output not in FORMATS:
+            raise ValidationError(f'output must be one of: {", ".join(FORMATS)}.')
+        try:
+            date_from, date_to = (
+                date.fromisoformat(value) if value else None
+                for value in (request.query_params.get('date_from'), request.query_params.get('date_to'))
+            )
+        except ValueError:
+            raise ValidationError('Dates must be in YYYY-MM-DD format.')
+
+        stream, content_type = FORMATS[output]
+        header, rows = export_rows(dataset, date_from, date_to)
+        response = StreamingHttpResponse(stream(header, rows), content_type=content_type)
+        response.headers['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+        return response
 
 
 ########################################## REVIEW ##############################################
@@ -162,9 +383,32 @@ class ReviewUpdateAPIView(UpdateAPIView):
 class ReviewListAPIView(ListAPIView):
     queryset = Review.objects.all()
     serializer_class = ReviewModelSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Review.objects.filter(user=self.request.user).select_related('user')
+
+
+@extend_schema(tags=['review'])
+class CarReviewListAPIView(ListAPIView):
+    serializer_class = ReviewModelSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Review.objects.filter(user=self.request.user).select_related('car').order_by('-created_at')
+        return Review.objects.filter(car_id=self.kwargs['pk']).select_related('user')
+
+    def list(self, request, *args, **kwargs):
+        car = get_object_or_404(
+            Car.objects.only('review_count', 'rating_avg', *(f'rating_{i}' for i in range(1, 6))), pk=kwargs['pk']
+        )
+        response = super().list(request, *args, **kwargs)
+        response.data = {
+            'review_count': car.review_count,
+            'rating_avg': car.rating_avg,
+            'rating_histogram': car.rating_histogram,
+            **response.data,
+        }
+        return response
 
 
 @extend_schema(tags=['review'])
@@ -205,13 +449,20 @@ class CarImagesDeleteAPIView(DestroyAPIView):
 
 ########################################## RENT ##############################################
 @extend_schema(tags=['rental-order'])
-class RentalOrderListCreateView(APIView):
+class RentalOrderListCreateView(GenericAPIView):
     serializer_class = RentalOrderSerializer
+    pagination_class = KeysetPagination
 
     def get(self, request):
-        orders = RentalOrder.objects.filter(user=request.user)
-        serializer = RentalOrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = (
+            RentalOrder.objects
+            .filter(user=request.user)
+            .select_related('billing', 'rental__car')
+            .prefetch_related(*CarModelSerializer.get_prefetches('rental__car__'))
+        )
+        page = self.paginate_queryset(orders)
+        serializer = RentalOrderSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def post(self, request):
         serializer = RentalOrderSerializer(
@@ -247,10 +498,11 @@ class RegionDeleteAPIView(DestroyAPIView):
     lookup_field = 'pk'
 
 
-class RegionListAPIView(ListAPIView):
+class RegionListAPIView(CachedResponseMixin, ListAPIView):
     serializer_class = RegionModelSerializer
     permission_classes = [IsAuthenticated]
     queryset = Region.objects.all()
+    cache_models = (Region,)
 
 
 ########################################## DISTRICT ##############################################
@@ -278,7 +530,8 @@ class DistrictDeleteAPIView(DestroyAPIView):
 
 
 @extend_schema(tags=['district'])
-class DistrictListAPIView(ListAPIView):
+class DistrictListAPIView(CachedResponseMixin, ListAPIView):
     serializer_class = DistrictModelSerializer
     permission_classes = [IsAuthenticated]
     queryset = District.objects.all()
+    cache_models = (District,)
@@ -1,9 +1,10 @@
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import UserManager, AbstractUser
-from django.db.models import ImageField, Model, DateTimeField, ForeignKey, CASCADE
+from django.db.models import ImageField, Model, DateTimeField, ForeignKey, CASCADE, Index, JSONField
 from django.db.models.fields import CharField, EmailField
 
 from apps.models import Car
+from apps.storage import content_storage
 
 
 class CustomerUser(UserManager):
@@ -40,7 +41,8 @@ class CustomerUser(UserManager):
 class User(AbstractUser):
     first_name = CharField(max_length=35)
     last_name = CharField(max_length=35)
-    avatar = ImageField(upload_to='avatars/%Y/%m/%d/', null=True, blank=True)
+    avatar = ImageField(upload_to='avatars/%Y/%m/%d/', storage=content_storage, null=True, blank=True)
+    avatar_renditions = JSONField(default=list, editable=False)
     email = EmailField(unique=True)
     district = ForeignKey('apps.District', on_delete=CASCADE, related_name='users', null=True, blank=True)
     updated_at = DateTimeField(auto_now=True)
@@ -50,11 +52,21 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    class Meta:
+        indexes = [
+            Index(fields=['date_joined', 'id']),
+        ]
+
 
 class Wishlist(Model):
     user = ForeignKey('authentication.User', on_delete=CASCADE)
     car = ForeignKey('apps.Car', on_delete=CASCADE)
     created_at = DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            Index(fields=['user', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f'{self.user.first_name} - {self.user.last_name} wishlist'
@@ -9,6 +9,7 @@ from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.serializers import ModelSerializer, Serializer
 
 from apps.models import Car
+from apps.renditions import SrcsetField
 from authentication.models import User, Wishlist
 from root.settings import redis
 
@@ -16,10 +17,12 @@ from root.settings import redis
 class UserModelSerializer(ModelSerializer):
     referral_code = CharField(read_only=True)
     referred_by_code = CharField(write_only=True, required=False)
+    avatar_srcset = SrcsetField(source='avatar_renditions')
 
     class Meta:
         model = User
-        fields = ('first_name', 'last_name', 'email', 'avatar', 'password', "referral_code", "referred_by_code")
+        fields = ('first_name', 'last_name', 'email', 'avatar', 'avatar_srcset', 'password', "referral_code",
+                  "referred_by_code")
         read_only_fields = ('id', 'date_joined', 'updated_at')
 
     def validate_email(self, value):
@@ -1,10 +1,9 @@
 from django.urls import path
-from rest_framework.generics import ListAPIView
 
 from authentication.views import UserUpdateAPIView, ChangePasswordAPIView, \
     UserDeleteAPIView, WishlistCreateAPIView, WishlistDeleteAPIView, WishlistListAPIView, \
     WishlistRetrieveAPIView, CustomTokenObtainPairView, CustomTokenRefreshView, UserGenericAPIView, \
-    VerifyCodeGenericAPIView
+    VerifyCodeGenericAPIView, UserListAPIView
 
 # auth
 urlpatterns = [
@@ -18,7 +17,7 @@ urlpatterns += [
     path('user-create', UserGenericAPIView.as_view()),
     path('user-update/<int:pk>', UserUpdateAPIView.as_view()),
     path('user-delete/<int:pk>', UserDeleteAPIView.as_view()),
-    path('users', ListAPIView.as_view()),
+    path('users', UserListAPIView.as_view()),
     path('user-change-passwd/<int:pk>', ChangePasswordAPIView.as_view()),
     path('verify/code', VerifyCodeGenericAPIView.as_view()),
 
@@ -14,6 +14,8 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from authentication.models import User, Wishlist
 from authentication.serializers import UserModelSerializer, UserUpdateSerializer, ChangePasswordSerializer, \
     WishlistModelSerializer, VerifyCodeSerializer
+from apps.pagination import KeysetPagination
+from apps.serializers import CarModelSerializer
 from authentication.tasks import send_code_email
 from root.settings import redis
 
@@ -89,6 +91,10 @@ class UserListAPIView(ListAPIView):
     permission_classes = [IsAdminUser]
     filter_backends = [SearchFilter]
     search_fields = ['first_name', 'last_name', 'email']
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        '-date_joined': ('-date_joined', '-id'),
+    }
 
 
 ###################################### PASSWORD ######################################
@@ -112,9 +118,15 @@ class WishlistCreateAPIView(CreateAPIView):
 @extend_schema(tags=['wishlist'])
 class WishlistListAPIView(ListAPIView):
     serializer_class = WishlistModelSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user).select_related('car').order_by('-created_at')
+        return (
+            Wishlist.objects
+            .filter(user=self.request.user)
+            .select_related('car')
+            .prefetch_related(*CarModelSerializer.get_prefetches('car__'))
+        )
 
 
 @extend_schema(tags=['wishlist'])
@@ -3,7 +3,9 @@ from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, LabeledPrice, PreCheckoutQuery, Message, SuccessfulPayment
 from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException
 
+from apps.bookings import create_booking, record_card_payment
 from apps.models import Car, RentByBot, Location
 from bot.dispatcher import dp
 from bot.loader import bot
@@ -32,7 +34,8 @@ def save_rent_to_db(data: dict, tg_user_id: int) -> RentByBot:
     pickup_location = Location.objects.get(name=data["pickup_location"])
     dropoff_location = Location.objects.get(name=data["dropoff_location"])
 
-    rent = RentByBot.objects.create(
+    rent = create_booking(
+        RentByBot,
         car=car,
         name=data["name"],
         phone=data["phone"],
@@ -54,7 +57,14 @@ async def choose_payment(callback: CallbackQuery, state: FSMContext):
     await state.update_data(payment_method=method)
 
     data = await state.get_data()
-    rent = await save_rent_to_db(data, tg_user_id=callback.from_user.id)
+    try:
+        rent = await save_rent_to_db(data, tg_user_id=callback.from_user.id)
+    except APIException as e:
+        detail = e.detail[0] if isinstance(e.detail, list) else e.detail
+        await callback.message.answer(f"❌ {detail}\n\nPlease choose other dates.")
+        await state.clear()
+        await callback.answer()
+        return
 
     if method == "cash":
         await callback.message.answer(build_summary(rent) + "\n\n💵 Please pay in cash at pickup.")
@@ -81,26 +91,26 @@ async def choose_payment(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+@sync_to_async
+def is_rent_payable(payload: str) -> bool:
+    _, _, rent_id = payload.partition(":")
+    return rent_id.isdigit() and RentByBot.objects.filter(id=int(rent_id), payment_status="pending").exists()
+
+
 @dp.pre_checkout_query()
 async def pre_checkout(pre_checkout_query: PreCheckoutQuery):
+    # Bookings left unpaid too long are released by expire_unpaid_bookings and can no longer be paid.
+    if not await is_rent_payable(pre_checkout_query.invoice_payload):
+        await bot.answer_pre_checkout_query(
+            pre_checkout_query.id, ok=False, error_message="This booking has expired. Please book again."
+        )
+        return
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
 
 @sync_to_async
 def mark_paid(rent_id: int, charge_id: str, amount: int, currency: str):
-    try:
-        rent = (
-            RentByBot.objects
-            .select_related("car", "pickup_location", "dropoff_location")
-            .get(id=rent_id)
-        )
-        rent.payment_status = "paid"
-        rent.paid_amount = amount
-        rent.paid_currency = currency
-        rent.save(update_fields=[])
-        return rent
-    except RentByBot.DoesNotExist:
-        return None
+    return record_card_payment(rent_id, charge_id, amount, currency)
 
 
 @dp.message(F.successful_payment)
@@ -121,7 +131,12 @@ async def successful_payment(message: Message, state: FSMContext):
             currency=sp.currency,
         )
 
-    if rent:
+    if rent and rent.refund_due:
+        await message.answer(
+            "⚠️ Your booking expired before the payment arrived and the car has been booked by someone else.\n"
+            f"💰 {sp.total_amount / 100} {sp.currency} will be refunded."
+        )
+    elif rent:
         await message.answer(
             "✅ Payment successful!\n\n"
             f"{build_summary(rent)}\n"
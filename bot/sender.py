@@ -1,53 +1,81 @@
-import asyncio
+from html import escape
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InputMediaPhoto, FSInputFile
 from asgiref.sync import sync_to_async
 
-from apps.models import Car
+from apps.models import Car, ImageBlob
+from bot.buttons import keyboard
 from core.config import conf
 
 
 def get_car_data(car: Car):
     return {
         'id': car.id,
-        'name': car.name,
-        'description': car.description,
-        'category': str(car.category),
+        'name': escape(car.name),
+        'description': car.description_caption,
+        'category': escape(str(car.category)),
         'capacity': car.capacity,
         'steering': car.steering,
-        'gasoline': car.gasoline,
+        'gasoline': escape(car.gasoline),
         'price': car.price,
         'main_image_path': car.main_image.path if car.main_image else None,
+        'main_image_name': car.main_image.name if car.main_image else None,
         'telegram_message_id': car.telegram_message_id,
     }
 
 
-async def _send(car: Car):
-    car_data = await sync_to_async(get_car_data)(car)
-
-    bot = Bot(
-        token=conf.bot.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode="Markdown")
+def get_file_ids(names):
+    """Telegram file_ids of already uploaded images, keyed by their content-addressed storage name."""
+    return dict(
+        ImageBlob.objects.filter(name__in=[name for name in names if name]).exclude(telegram_file_id='')
+        .values_list('name', 'telegram_file_id')
     )
+
+
+def remember_file_ids(file_ids):
+    for name, file_id in file_ids.items():
+        ImageBlob.objects.filter(name=name).update(telegram_file_id=file_id)
+
+
+async def get_photo(path, name):
+    file_ids = await sync_to_async(get_file_ids)([name])
+    return file_ids.get(name) or FSInputFile(path)
+
+
+async def remember_photo(name, photo, msg):
+    if isinstance(photo, FSInputFile) and getattr(msg, 'photo', None):
+        await sync_to_async(remember_file_ids)({name: msg.photo[-1].file_id})
+
+
+def get_caption(car_data):
     link = f"https://t.me/{conf.bot.BOT_USERNAME}?start=car_{car_data['id']}"
-    caption = (
-        f"🚗 **{car_data['name']}**\n"
+    return (
+        f"🚗 <b>{car_data['name']}</b>\n"
         f"🗂 Category: {car_data['category']}\n"
         f"👥 Capacity: {car_data['capacity']}\n"
         f"⚙ Steering: {car_data['steering']}\n"
         f"⛽ Gasoline: {car_data['gasoline']}\n"
         f"💰 Price: {car_data['price']} sum\n"
         f"📝 Description: {car_data['description']}\n\n"
-        f"[For more information]({link})"
+        f'<a href="{link}">For more information</a>'
     )
+
+
+async def _send(bot: Bot, car: Car):
+    car_data = await sync_to_async(get_car_data)(car)
+
+    caption = get_caption(car_data)
     if car_data['main_image_path']:
+        photo = await get_photo(car_data['main_image_path'], car_data['main_image_name'])
         msg = await bot.send_photo(
             chat_id=conf.bot.CHANNEL_ID,
-            photo=FSInputFile(car_data['main_image_path']),
+            photo=photo,
             caption=caption
         )
+        await remember_photo(car_data['main_image_name'], photo, msg)
     else:
         msg = await bot.send_message(
             chat_id=conf.bot.CHANNEL_ID,
@@ -58,51 +86,58 @@ async def _send(car: Car):
         telegram_message_id=msg.message_id
     )
 
-    await bot.session.close()
 
+async def _update(bot: Bot, car: Car):
+    car_data = await sync_to_async(get_car_data)(car)
 
-def send_car_to_channel(car):
-    asyncio.run(_send(car))
-
+    caption = get_caption(car_data)
+    try:
+        if car_data['main_image_path']:
+            photo = await get_photo(car_data['main_image_path'], car_data['main_image_name'])
+            media = InputMediaPhoto(
+                media=photo,
+                caption=caption,
+                parse_mode="HTML"
+            )
+            msg = await bot.edit_message_media(
+                chat_id=conf.bot.CHANNEL_ID,
+                message_id=car_data['telegram_message_id'],
+                media=media
+            )
+            await remember_photo(car_data['main_image_name'], photo, msg)
+        else:
+            await bot.edit_message_text(
+                chat_id=conf.bot.CHANNEL_ID,
+                message_id=car_data['telegram_message_id'],
+                text=caption
+            )
+    except TelegramBadRequest as e:
+        # Coalesced edits can leave nothing to change since the last one.
+        if 'message is not modified' not in e.message:
+            raise
+
+
+async def notify_customer(bot: Bot, chat_id, car: Car):
+    """Tell a past customer that a car like the one they rented is available."""
+    text = (
+        f"🚘 A similar car that you ordered before is available again!\n\n"
+        f"📌 {escape(car.name)}\n"
+        f"💰 Price: {car.price}\n"
+        f"⚙️ Details: {car.description_caption or 'No details'}"
+    )
+    await bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
 
-async def _update(car: Car):
-    car_data = await sync_to_async(get_car_data)(car)
 
-    bot = Bot(
+def get_bot():
+    return Bot(
         token=conf.bot.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode="Markdown")
+        default=DefaultBotProperties(parse_mode="HTML")
     )
-    link = f"https://t.me/{conf.bot.BOT_USERNAME}?start=car_{car_data['id']}"
-    caption = (
-        f"🚗 **{car_data['name']}**\n"
-        f"🗂 Category: {car_data['category']}\n"
-        f"👥 Capacity: {car_data['capacity']}\n"
-        f"⚙ Steering: {car_data['steering']}\n"
-        f"⛽ Gasoline: {car_data['gasoline']}\n"
-        f"💰 Price: {car_data['price']} sum\n"
-        f"📝 Description: {car_data['description']}\n\n"
-        f"[For more information]({link})"
-    )
-    if car_data['main_image_path']:
-        media = InputMediaPhoto(
-            media=FSInputFile(car_data['main_image_path']),
-            caption=caption,
-            parse_mode="Markdown"
-        )
-        await bot.edit_message_media(
-            chat_id=conf.bot.CHANNEL_ID,
-            message_id=car_data['telegram_message_id'],
-            media=media
-        )
-    else:
-        await bot.edit_message_text(
-            chat_id=conf.bot.CHANNEL_ID,
-            message_id=car_data['telegram_message_id'],
-            text=caption
-        )
 
-    await bot.session.close()
 
-
-def update_car_post(car):
-    asyncio.run(_update(car))
+async def post_car(bot: Bot, car: Car):
+    """Post the car to the channel, or edit its post when it already has one."""
+    if car.telegram_message_id:
+        await _update(bot, car)
+    else:
+        await _send(bot, car)
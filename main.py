@@ -1,4 +1,5 @@
 import os
+from html import escape
 
 import django
 
@@ -14,6 +15,7 @@ from bot.handlers.payment import *
 from apps.signals import *
 
 from apps.models import Car
+from bot.sender import get_file_ids, remember_file_ids
 from core.config import conf
 
 bot = Bot(token=conf.bot.BOT_TOKEN)
@@ -48,16 +50,17 @@ async def start(message: Message):
             if car.main_image:
                 images.append(car.main_image)
             images.extend([ci.images for ci in car.carimages_set.all()])
-            file_paths = [img.path for img in images if img]
+            images = [img for img in images if img]
+            file_ids = await sync_to_async(get_file_ids)([img.name for img in images])
 
             caption = (
-                f"🚗 Name: {car.name}\n"
+                f"🚗 Name: {escape(car.name)}\n"
                 f"💰 Price: ${car.price}\n"
-                f"⛽ Gasoline: {car.gasoline}\n"
+                f"⛽ Gasoline: {escape(car.gasoline)}\n"
                 f"⚙ Steering: {car.steering}\n"
                 f"👥 Capacity: {car.capacity}\n"
-                f"🗂 Category: {car.category.name}\n"
-                f"📝 Description: {car.description}\n"
+                f"🗂 Category: {escape(car.category.name)}\n"
+                f"📝 Description: {car.description_caption}\n"
             )
 
             keyboard = InlineKeyboardMarkup(
@@ -66,14 +69,21 @@ async def start(message: Message):
                 ]
             )
 
-            if file_paths:
-                media = [InputMediaPhoto(media=FSInputFile(path)) for path in file_paths]
+            if images:
+                media = [InputMediaPhoto(media=file_ids.get(img.name) or FSInputFile(img.path)) for img in images]
                 media[0].caption = caption
-                await message.answer_media_group(media=media)
+                media[0].parse_mode = "HTML"
+                messages = await message.answer_media_group(media=media)
+                uploaded = {
+                    img.name: msg.photo[-1].file_id
+                    for img, msg in zip(images, messages) if img.name not in file_ids and msg.photo
+                }
+                if uploaded:
+                    await sync_to_async(remember_file_ids)(uploaded)
 
                 await message.answer("Do you want to rent this car?", reply_markup=keyboard)
             else:
-                await message.answer(f"{caption}\nNo images available.", reply_markup=keyboard)
+                await message.answer(f"{caption}\nNo images available.", reply_markup=keyboard, parse_mode="HTML")
 
         except Car.DoesNotExist:
             await message.answer("Car not found!")
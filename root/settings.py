@@ -3,6 +3,7 @@ from datetime import timedelta
 from os.path import join
 from pathlib import Path
 
+from celery.schedules import crontab
 from redis import Redis
 
 from core.config import conf, EmailConfig, RedisConfig, DatabaseConfig
@@ -23,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.admin',
+    'django.contrib.postgres',
     # my apps
     'authentication',
     'apps',
@@ -169,7 +171,8 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = EmailConfig.EMAIL_USER
 EMAIL_HOST_PASSWORD = EmailConfig.EMAIL_PASSWORD
 
-CELERY_TASK_ALWAYS_EAGER = True
+# Tasks run inline unless a worker is deployed, as in docker-compose.yml.
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'true').lower() == 'true'
 
 CELERY_BROKER_URL = RedisConfig.CELERY_BROKER_URL
 
@@ -179,3 +182,38 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
 CELERY_TIMEZONE = 'Asia/Tashkent'
+
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-category-car-amounts': {
+        'task': 'apps.tasks.reconcile_category_car_amounts',
+        'schedule': crontab(minute=0, hour=3),
+    },
+    'reconcile-car-ratings': {
+        'task': 'apps.tasks.reconcile_car_ratings',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'rebuild-rental-counters': {
+        'task': 'apps.tasks.rebuild_rental_counters',
+        'schedule': crontab(minute=0, hour=4),
+    },
+    'build-daily-rollups': {
+        'task': 'apps.tasks.build_daily_rollups',
+        'schedule': crontab(minute=0, hour=2),
+    },
+    'build-intraday-rollups': {
+        'task': 'apps.tasks.build_intraday_rollups',
+        'schedule': crontab(minute='*/15'),
+    },
+    'expire-unpaid-bookings': {
+        'task': 'apps.tasks.expire_unpaid_bookings',
+        'schedule': crontab(minute='*/5'),
+    },
+    'reconcile-image-blobs': {
+        'task': 'apps.tasks.reconcile_image_blobs',
+        'schedule': crontab(minute=30, hour=4),
+    },
+    'collect-image-blobs': {
+        'task': 'apps.tasks.collect_image_blobs',
+        'schedule': crontab(minute=0, hour=5),
+    },
+}